@@ -1,3 +1,22 @@
+import json
+import os
+import random
+import tempfile
+import time
+from bisect import bisect_right
+
+
+# File that calibrate_insertion_cutoff saves the measured cutoff to
+_CUTOFF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'insertion_cutoff.json')
+
+# Cutoff used by merge_sort when the machine has not been calibrated
+_DEFAULT_INSERTION_CUTOFF = 64
+
+# Cutoff used by merge_sort, loaded lazily from _CUTOFF_PATH
+_insertion_cutoff = None
+
+
 def insertion_sort(lst):
     """
     Sorts the list lst in place using insertion_sort.
@@ -15,20 +34,89 @@ def insertion_sort(lst):
         lst[j+1] = key 
 
 
-def merge_sort(lst, p, r):
+def merge_sort(lst, p, r, cutoff=None):
     """
     Sorts the list lst in place using merge_sort.
 
+    The range is first cut into blocks of cutoff elements that are
+    sorted with binary insertion sort. The sort then proceeds bottom-up:
+    sorted runs of width cutoff, 2 * cutoff, ... are merged back and
+    forth between lst[p..r] and a single scratch buffer that is
+    allocated once up front, so no lists are created while merging.
+
     Args:
         lst: list to be sorted
         p: starting index of the list, i.e 0
         r: ending index of the list, i.e. len(lst) - 1
+        cutoff: size of the blocks sorted with insertion sort. Defaults
+            to the cutoff saved by calibrate_insertion_cutoff in
+            insertion_cutoff.json next to this module, or to
+            _DEFAULT_INSERTION_CUTOFF if it has not been run
+    """
+    n = r - p + 1
+    if n < 2:
+        return
+
+    if cutoff is None:
+        cutoff = _get_insertion_cutoff()
+    cutoff = max(1, cutoff)
+
+    if cutoff > 1:
+        for lo in range(p, r + 1, cutoff):
+            _binary_insertion_sort(lst, lo, min(lo + cutoff, r + 1), lo + 1)
+
+    if cutoff >= n:
+        return
+
+    src, src_off = lst, p
+    dst, dst_off = [None] * n, 0
+    width = cutoff
+    while width < n:
+        for lo in range(0, n, 2 * width):
+            mid = min(lo + width, n)
+            hi = min(lo + 2 * width, n)
+            _merge_runs(src, src_off, dst, dst_off, lo, mid, hi)
+
+        # the buffer just written becomes the source of the next pass
+        src, src_off, dst, dst_off = dst, dst_off, src, src_off
+        width *= 2
+
+    # an odd number of passes leaves the result in the scratch buffer
+    if src is not lst:
+        lst[p:r+1] = src
+
+
+def _merge_runs(src, src_off, dst, dst_off, lo, mid, hi):
+    """
+    Merges the sorted runs src[lo..mid - 1] and src[mid..hi - 1] into
+    dst[lo..hi - 1]. Each list is addressed relative to its own offset.
+    Equal elements are taken from the left run first to keep the sort
+    stable.
     """
-    if p < r:
-        q = (p + r) // 2
-        merge_sort(lst, p, q)
-        merge_sort(lst, q+1, r)
-        merge(lst, p, q, r)
+    i = src_off + lo
+    i_end = src_off + mid
+    j = i_end
+    j_end = src_off + hi
+    k = dst_off + lo
+
+    while i < i_end and j < j_end:
+        if src[i] <= src[j]:
+            dst[k] = src[i]
+            i += 1
+        else:
+            dst[k] = src[j]
+            j += 1
+        k += 1
+
+    while i < i_end:
+        dst[k] = src[i]
+        i += 1
+        k += 1
+
+    while j < j_end:
+        dst[k] = src[j]
+        j += 1
+        k += 1
 
 
 def merge(lst, p, q, r):
@@ -54,4 +142,100 @@ def merge(lst, p, q, r):
         else:
             lst[k] = right[j]
             j += 1
-    
+
+
+def calibrate_insertion_cutoff(max_size=1024, n_trials=5, n=10000, path=None):
+    """
+    Finds the insertion sort cutoff with which merge_sort is fastest on
+    this machine and saves it.
+
+    The same random list of n elements is sorted with merge_sort at
+    every candidate cutoff, 1 and then geometrically increasing sizes
+    (4, 6, 8, 12, 16, ...), and the cutoff of the fastest run is kept.
+    The result is written as JSON to path. Saved to the default path,
+    it becomes the default cutoff of merge_sort in this and later
+    processes. The calibration is never run implicitly.
+
+    Args:
+        max_size (int): largest cutoff to try
+        n_trials (int): number of timed runs per cutoff, each on a new
+            list; the fastest is kept
+        n (int): length of the lists sorted
+        path (str): file to save the cutoff to. Defaults to
+            insertion_cutoff.json next to this module.
+    Returns:
+        int: the measured cutoff
+    """
+    global _insertion_cutoff
+
+    sizes = [1]
+    size = 4
+    while size <= max_size:
+        sizes.append(size)
+        if size + size // 2 <= max_size:
+            sizes.append(size + size // 2)
+        size *= 2
+
+    best_times = {size: float('inf') for size in sizes}
+    for i in range(n_trials):
+        numbers = [random.random() for _ in range(n)]
+        for size in sizes:
+            lst = numbers[:]
+            start = time.perf_counter()
+            merge_sort(lst, 0, n - 1, cutoff=size)
+            best_times[size] = min(best_times[size],
+                                   time.perf_counter() - start)
+
+    cutoff = min(sizes, key=best_times.get)
+
+    if path is None:
+        path = _CUTOFF_PATH
+        _insertion_cutoff = cutoff
+
+    # write to a temporary file first so that readers never see a
+    # partly written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fl:
+            json.dump({'insertion_cutoff': cutoff}, fl)
+        os.replace(tmp_path, path)
+    except OSError:
+        # the measurement is still used for this process
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return cutoff
+
+
+def _get_insertion_cutoff():
+    """
+    Returns the cutoff used by merge_sort, loading it from the file
+    written by calibrate_insertion_cutoff. If the machine has not been
+    calibrated, _DEFAULT_INSERTION_CUTOFF is used.
+    """
+    global _insertion_cutoff
+
+    if _insertion_cutoff is None:
+        try:
+            with open(_CUTOFF_PATH) as fl:
+                _insertion_cutoff = int(json.load(fl)['insertion_cutoff'])
+        except (OSError, ValueError, KeyError, TypeError):
+            _insertion_cutoff = _DEFAULT_INSERTION_CUTOFF
+
+    return _insertion_cutoff
+
+
+def _binary_insertion_sort(lst, lo, hi, start):
+    """
+    Sorts lst[lo..hi - 1] in place, given that lst[lo..start - 1] is
+    already sorted. The insertion point of each element is found by
+    binary search and the larger elements are shifted over with a
+    single slice assignment.
+    """
+    for i in range(start, hi):
+        key = lst[i]
+        pos = bisect_right(lst, key, lo, i)
+        if pos != i:
+            lst[pos+1:i+1] = lst[pos:i]
+            lst[pos] = key
@@ -1,13 +1,38 @@
 import unittest
 
+import json
+import os
 import random
+import tempfile
 
+import sorting
+from sorting import calibrate_insertion_cutoff
 from sorting import merge
 from sorting import merge_sort
 
 N_NUMBERS = 10
 
 
+class Key:
+    """
+    Wraps a value so that comparisons only look at k,
+    which makes it possible to observe sort stability.
+    """
+
+    def __init__(self, k, i):
+        self.k = k
+        self.i = i
+
+    def __le__(self, other):
+        return self.k <= other.k
+
+    def __lt__(self, other):
+        return self.k < other.k
+
+    def __gt__(self, other):
+        return self.k > other.k
+
+
 class TestMergeSort(unittest.TestCase):
     def test_merge_sort_random(self):
         """
@@ -47,6 +72,94 @@ class TestMergeSort(unittest.TestCase):
 
         self.assertListEqual(observed, expected)
 
+    def test_merge_sort_subrange(self):
+        """
+        Tests that merge sort only sorts the requested
+        subrange and leaves the rest of the list untouched.
+        """
+
+        for n in range(1, 2 * N_NUMBERS + 2):
+            numbers = [random.random() for i in range(n)]
+            p = n // 4
+            r = n - 1 - n // 5
+
+            observed = numbers[:]
+            merge_sort(observed, p, r)
+
+            expected = numbers[:p] + sorted(numbers[p:r+1]) + numbers[r+1:]
+
+            self.assertListEqual(observed, expected)
+
+    def test_merge_sort_stable(self):
+        """
+        Tests that merge sort keeps equal elements in
+        their original order.
+        """
+
+        pairs = [(random.randint(0, 3), i) for i in range(N_NUMBERS * 3)]
+        keys = [Key(k, i) for k, i in pairs]
+
+        merge_sort(keys, 0, len(keys) - 1)
+
+        observed = [(key.k, key.i) for key in keys]
+        expected = sorted(pairs, key=lambda pair: pair[0])
+
+        self.assertListEqual(observed, expected)
+
+    def test_merge_sort_cutoffs(self):
+        """
+        Tests the hybrid merge sort with insertion sort cutoffs
+        smaller than, equal to and larger than the list.
+        """
+
+        numbers = [random.random() for i in range(N_NUMBERS * 10)]
+        expected = sorted(numbers)
+
+        for cutoff in [1, 2, 3, 16, len(numbers), len(numbers) + 1]:
+            observed = numbers[:]
+            merge_sort(observed, 0, len(observed) - 1, cutoff=cutoff)
+
+            self.assertListEqual(observed, expected)
+
+    def test_calibrate_insertion_cutoff(self):
+        """
+        Tests that calibration saves the measured cutoff, without
+        changing the default cutoff when saving elsewhere.
+        """
+        default = sorting._get_insertion_cutoff()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'cutoff.json')
+            cutoff = calibrate_insertion_cutoff(max_size=16, n_trials=2,
+                                                n=1000, path=path)
+
+            with open(path) as fl:
+                saved = json.load(fl)
+
+        self.assertGreaterEqual(cutoff, 1)
+        self.assertLessEqual(cutoff, 16)
+        self.assertEqual(saved['insertion_cutoff'], cutoff)
+        self.assertEqual(default, sorting._get_insertion_cutoff())
+
+    def test_default_insertion_cutoff(self):
+        """
+        Tests that an uncalibrated machine uses the default cutoff
+        without measuring or writing a file.
+        """
+        saved = sorting._CUTOFF_PATH, sorting._insertion_cutoff
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sorting._CUTOFF_PATH = os.path.join(tmpdir, 'cutoff.json')
+            sorting._insertion_cutoff = None
+            try:
+                numbers = [random.random() for _ in range(1000)]
+                merge_sort(numbers, 0, len(numbers) - 1)
+
+                self.assertEqual(sorting._DEFAULT_INSERTION_CUTOFF,
+                                 sorting._get_insertion_cutoff())
+                self.assertListEqual([], os.listdir(tmpdir))
+            finally:
+                sorting._CUTOFF_PATH, sorting._insertion_cutoff = saved
+
     def test_merge(self):
         """
         Tests that the merge operation successfully
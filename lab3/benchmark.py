@@ -0,0 +1,385 @@
+"""Benchmarks for the sorts and heaps in sorting.py
+
+Run as a script to time the sorts and optionally write the results as
+JSON or compare them against a stored baseline, e.g.
+
+    python benchmark.py --sizes 1000 10000 --output baseline.json
+    python benchmark.py --sizes 1000 10000 --baseline baseline.json
+
+The exit status is 1 if any result is slower or uses more memory than
+the baseline allows. The inputs are generated from a fixed seed
+(--seed), so every run and the baseline sort the same lists. See
+python benchmark.py --help for all options.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import sorting
+
+
+CASES = ['random', 'sorted', 'reverse sorted', 'few unique', 'sawtooth']
+
+VALUES = ['float', 'int', 'int32', 'int64']
+
+# Default seed for the generated inputs
+SEED = 0
+
+
+def make_case(n, case, values='float'):
+    """Generates a list of n random values in the given order
+
+    Args:
+        n (int): number of elements
+        case (str): 'random', 'sorted', 'reverse sorted', 'few unique'
+            for random values drawn from only 10 distinct ones, or
+            'sawtooth' for sorted runs of about sqrt(n) values each
+        values (str): 'float' for floats in [0, 1), 'int' for ints in
+            [0, n], 'int32' and 'int64' for non-negative ints of that width
+    Returns:
+        list: the generated list
+    """
+    if values == 'float':
+        lst = [random.random() for _ in range(n)]
+    elif values == 'int':
+        lst = [random.randint(0, n) for _ in range(n)]
+    elif values == 'int32':
+        lst = [random.getrandbits(32) for _ in range(n)]
+    elif values == 'int64':
+        lst = [random.getrandbits(63) for _ in range(n)]
+    else:
+        raise ValueError(f'Unknown values: {values}')
+
+    if case == 'sorted':
+        lst.sort()
+    elif case == 'reverse sorted':
+        lst.sort(reverse=True)
+    elif case == 'few unique':
+        distinct = lst[:10]
+        lst = [random.choice(distinct) for _ in range(n)]
+    elif case == 'sawtooth':
+        run = max(1, int(n ** 0.5))
+        for i in range(0, n, run):
+            lst[i:i+run] = sorted(lst[i:i+run])
+    elif case != 'random':
+        raise ValueError(f'Unknown case: {case}')
+
+    return lst
+
+
+def seed_case(seed, n, case, values='float'):
+    """Seeds random for generating the inputs of one case
+
+    Every combination of seed, n, case and values gets its own seed, so
+    a case sorts the same lists whichever other cases are run.
+
+    Args:
+        seed (int): the seed of the whole run
+        n (int): number of elements
+        case (str): input order, see make_case
+        values (str): kind of values, see make_case
+    """
+    random.seed(f'{seed}:{n}:{case}:{values}')
+
+
+def benchmark_heap_arity(arities=(2, 4, 8), numbers=(1000, 10000, 100000),
+                         cases=CASES, n_trials=3, seed=SEED):
+    """Times DaryHeap for each arity on each input order
+
+    Every element of the list is pushed onto an empty heap, then the
+    heap is popped until it is empty. Insert and extract times are
+    measured separately and averaged over n_trials.
+
+    Args:
+        arities (tuple): heap arities to compare
+        numbers (tuple): list sizes
+        cases (list): input orders, see make_case
+        n_trials (int): number of runs to average over
+        seed (int): seed for the inputs, see seed_case
+    Returns:
+        dict: maps (d, case, n) to a pair of mean insert and mean
+            extract times in seconds
+    """
+    results = dict()
+    for case in cases:
+        for n in numbers:
+            for d in arities:
+                seed_case(seed, n, case)
+                insert_time = extract_time = 0.0
+                for _ in range(n_trials):
+                    lst = make_case(n, case)
+                    heap = sorting.DaryHeap(d)
+
+                    start = time.perf_counter()
+                    for key in lst:
+                        heap.push(key)
+                    insert_time += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    while heap:
+                        heap.pop()
+                    extract_time += time.perf_counter() - start
+
+                results[(d, case, n)] = (insert_time / n_trials,
+                                         extract_time / n_trials)
+
+    return results
+
+
+SORTS = {
+    'insertion': sorting.insertion_sort,
+    'merge': lambda lst: sorting.merge_sort(lst, 0, len(lst) - 1),
+    'natural merge': lambda lst: sorting.natural_merge_sort(lst, 0, len(lst) - 1),
+    'heap': sorting.heapsort,
+    'counting': sorting.counting_sort,
+    'radix': sorting.radix_sort,
+    'auto': sorting.auto_sort,
+}
+
+
+def benchmark_sorts(sorts=SORTS, numbers=(1000, 10000, 100000), cases=CASES,
+                    values=VALUES, repeats=5, warmup=1, memory=True,
+                    max_insertion_n=1000, seed=SEED):
+    """Times each sort on each input order and kind of value
+
+    Every measurement sorts a freshly generated list. random is seeded
+    with seed_case before the runs of each sort, so all sorts, and all
+    runs with the same seed, get the same lists. The warmup runs
+    are discarded, and peak memory is measured on one extra run with
+    tracemalloc, which would slow down the timed runs.
+
+    Args:
+        sorts (dict): maps names to functions that sort a list in place
+        numbers (tuple): list sizes
+        cases (list): input orders, see make_case
+        values (list): kinds of values, see make_case
+        repeats (int): number of timed runs
+        warmup (int): number of untimed runs before them
+        memory (bool): whether to measure peak memory
+        max_insertion_n (int): largest list given to insertion sort,
+            which is quadratic
+        seed (int): seed for the inputs, see seed_case
+    Returns:
+        dict: maps (name, values, case, n) to the summary of the times
+            returned by summarize, with 'peak_memory' added in bytes if
+            memory is True. counting sort is only run on the 'int'
+            values, whose range is bounded by n
+    """
+    results = dict()
+    for kind in values:
+        for case in cases:
+            for n in numbers:
+                for name, sort in sorts.items():
+                    if name == 'insertion' and n > max_insertion_n:
+                        continue
+                    if name == 'counting' and kind != 'int':
+                        continue
+
+                    seed_case(seed, n, case, kind)
+                    times = []
+                    for i in range(warmup + repeats):
+                        lst = make_case(n, case, kind)
+                        start = time.perf_counter()
+                        sort(lst)
+                        elapsed = time.perf_counter() - start
+                        if i >= warmup:
+                            times.append(elapsed)
+
+                    result = summarize(times)
+                    if memory:
+                        result['peak_memory'] = peak_memory(
+                            sort, make_case(n, case, kind))
+                    results[(name, kind, case, n)] = result
+
+    return results
+
+
+def summarize(times):
+    """Summarizes a list of run times
+
+    Args:
+        times (list): run times in seconds, at least one
+    Returns:
+        dict: the 'median', 'p10' and 'p90' percentiles, 'min' and 'max'
+            of the times, and the number of runs as 'repeats'
+    """
+    times = sorted(times)
+    return {
+        'median': statistics.median(times),
+        'p10': percentile(times, 10),
+        'p90': percentile(times, 90),
+        'min': times[0],
+        'max': times[-1],
+        'repeats': len(times),
+    }
+
+
+def percentile(data, q):
+    """Computes the q-th percentile of sorted data
+
+    Interpolates linearly between the two closest values, so the 50th
+    percentile is the median.
+
+    Args:
+        data (list): sorted values, at least one
+        q (float): percentile between 0 and 100
+    Returns:
+        float: the percentile
+    """
+    pos = (len(data) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (pos - lo)
+
+
+def peak_memory(sort, lst):
+    """Measures the peak memory allocated while sorting lst
+
+    Args:
+        sort (function): sorts a list in place
+        lst (list): the list to sort
+    Returns:
+        int: the peak number of bytes allocated by the sort, not
+            counting the list itself
+    """
+    tracemalloc.start()
+    try:
+        sort(lst)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def save_results(results, path, seed=SEED):
+    """Writes the results of benchmark_sorts as JSON
+
+    Args:
+        results (dict): as returned by benchmark_sorts
+        path (str): the file to write
+        seed (int): the seed the results were measured with
+    """
+    records = [dict(sort=name, values=kind, case=case, n=n, **result)
+               for (name, kind, case, n), result in results.items()]
+    with open(path, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'results': records,
+        }, f, indent=2)
+
+
+def load_results(path):
+    """Reads results written by save_results
+
+    Args:
+        path (str): the file to read
+    Returns:
+        dict: the results in the form returned by benchmark_sorts
+    """
+    with open(path) as f:
+        records = json.load(f)['results']
+
+    results = dict()
+    for record in records:
+        result = dict(record)
+        run = tuple(result.pop(field) for field in ('sort', 'values', 'case', 'n'))
+        results[run] = result
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Finds the results that regressed against a baseline
+
+    A result regressed if its median time, or its peak memory when both
+    have one, is more than tolerance times the baseline's above it.
+    Results missing from either side are ignored.
+
+    Args:
+        results (dict): as returned by benchmark_sorts
+        baseline (dict): earlier results, e.g. from load_results
+        tolerance (float): allowed relative increase
+    Returns:
+        list: (run, metric, baseline value, new value) for every
+            regression, where run is the (name, values, case, n) key
+    """
+    regressions = []
+    for run, result in results.items():
+        if run not in baseline:
+            continue
+        for metric in ('median', 'peak_memory'):
+            if metric not in result or metric not in baseline[run]:
+                continue
+            old, new = baseline[run][metric], result[metric]
+            if new > old * (1 + tolerance):
+                regressions.append((run, metric, old, new))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sorts in sorting.py')
+    parser.add_argument('--sorts', nargs='+', choices=list(SORTS),
+                        default=list(SORTS))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--values', nargs='+', choices=VALUES, default=VALUES)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed for the generated inputs')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip measuring peak memory')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='compare against results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative increase over the baseline')
+    parser.add_argument('--heap-arity', action='store_true',
+                        help='also compare DaryHeap arities')
+    args = parser.parse_args(argv)
+
+    results = benchmark_sorts({name: SORTS[name] for name in args.sorts},
+                              args.sizes, args.cases, args.values,
+                              args.repeats, args.warmup, not args.no_memory,
+                              seed=args.seed)
+
+    print(f'{"sort":>15} {"values":>6} {"case":>15} {"n":>8} '
+          f'{"median (s)":>11} {"p10 (s)":>10} {"p90 (s)":>10} {"peak (KiB)":>11}')
+    for (name, kind, case, n), result in results.items():
+        peak = result.get('peak_memory')
+        peak = f'{peak / 1024:>11.1f}' if peak is not None else f'{"-":>11}'
+        print(f'{name:>15} {kind:>6} {case:>15} {n:>8} {result["median"]:>11.5f} '
+              f'{result["p10"]:>10.5f} {result["p90"]:>10.5f} {peak}')
+
+    if args.heap_arity:
+        print()
+        print(f'{"case":>15} {"n":>8} {"d":>3} {"insert (s)":>12} {"extract (s)":>12}')
+        for (d, case, n), (insert_time, extract_time) in benchmark_heap_arity(
+                numbers=args.sizes, cases=args.cases, seed=args.seed).items():
+            print(f'{case:>15} {n:>8} {d:>3} {insert_time:>12.5f} {extract_time:>12.5f}')
+
+    if args.output:
+        save_results(results, args.output, args.seed)
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline),
+                              args.tolerance)
+        for (name, kind, case, n), metric, old, new in regressions:
+            print(f'regression: {name} {kind} {case} n={n} {metric} '
+                  f'{old:.6g} -> {new:.6g}')
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import unittest
+
+import json
+import os
+import tempfile
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_make_case(self):
+        for case in benchmark.CASES:
+            lst = benchmark.make_case(100, case, 'int')
+            self.assertEqual(100, len(lst))
+
+        self.assertLessEqual(len(set(benchmark.make_case(1000, 'few unique'))), 10)
+
+        sawtooth = benchmark.make_case(100, 'sawtooth')
+        for i in range(0, 100, 10):
+            self.assertListEqual(sorted(sawtooth[i:i+10]), sawtooth[i:i+10])
+
+    def test_seeded(self):
+        """
+        The same seed gives the same inputs, whatever ran before.
+        """
+        benchmark.seed_case(1, 100, 'random', 'int')
+        expected = benchmark.make_case(100, 'random', 'int')
+
+        benchmark.make_case(10, 'sorted')
+        benchmark.seed_case(1, 100, 'random', 'int')
+        self.assertListEqual(expected, benchmark.make_case(100, 'random', 'int'))
+
+        benchmark.seed_case(2, 100, 'random', 'int')
+        self.assertNotEqual(expected, benchmark.make_case(100, 'random', 'int'))
+
+    def test_percentile(self):
+        data = [1, 2, 3, 4, 5]
+        self.assertEqual(1, benchmark.percentile(data, 0))
+        self.assertEqual(3, benchmark.percentile(data, 50))
+        self.assertEqual(5, benchmark.percentile(data, 100))
+        self.assertAlmostEqual(1.4, benchmark.percentile(data, 10))
+        self.assertEqual(7, benchmark.percentile([7], 90))
+
+    def test_save_load_compare(self):
+        results = benchmark.benchmark_sorts({'merge': benchmark.SORTS['merge']},
+                                            numbers=(100,), cases=['random'],
+                                            values=['float'], repeats=3)
+        run = ('merge', 'float', 'random', 100)
+        self.assertIn('peak_memory', results[run])
+
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            benchmark.save_results(results, path, seed=7)
+            baseline = benchmark.load_results(path)
+            with open(path) as f:
+                self.assertEqual(7, json.load(f)['seed'])
+        finally:
+            os.remove(path)
+
+        self.assertDictEqual(results, baseline)
+        self.assertListEqual([], benchmark.compare(results, baseline))
+
+        slower = {run: dict(results[run], median=results[run]['median'] * 2)}
+        regressions = benchmark.compare(slower, baseline, tolerance=0.5)
+        self.assertListEqual([run], [r[0] for r in regressions])
+        self.assertEqual('median', regressions[0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,39 @@
 import unittest
+from unittest import mock
 
 import random
+from array import array
+from bisect import bisect_left, bisect_right, insort
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import sorting
+from sorting import argsort
+from sorting import auto_sort
 from sorting import build_max_heap
+from sorting import counting_sort
+from sorting import DaryHeap
+from sorting import external_merge_sort
+from sorting import heap_extend
 from sorting import heap_extract_max
+from sorting import heap_meld
+from sorting import heap_pushpop
+from sorting import heap_replace
 from sorting import heapsort
+from sorting import insertion_sort
+from sorting import IndexedPriorityQueue
+from sorting import iter_sorted
 from sorting import max_heap_insert
+from sorting import merge_sort
+from sorting import natural_merge_sort
+from sorting import parallel_merge_sort
+from sorting import radix_sort
+from sorting import sort
+from sorting import SortedList
+from sorting import top_k
 
 from sorting import _left
 from sorting import _right
@@ -33,7 +61,32 @@ def satisfies_heap_property(heap, i=0):
         
     
     return left_valid and right_valid and satisfies_heap_property(heap, l) and satisfies_heap_property(heap, r)
-    
+
+
+class CountingKey:
+    """
+    Wraps a value and counts how many times it is compared.
+    Comparisons only look at k so that stability can be observed
+    through i.
+    """
+    comparisons = 0
+
+    def __init__(self, k, i=0):
+        self.k = k
+        self.i = i
+
+    def __lt__(self, other):
+        CountingKey.comparisons += 1
+        return self.k < other.k
+
+    def __le__(self, other):
+        CountingKey.comparisons += 1
+        return self.k <= other.k
+
+    def __gt__(self, other):
+        CountingKey.comparisons += 1
+        return self.k > other.k
+
 
 class TestHeap(unittest.TestCase):
     def test_max_heap_insert(self):
@@ -63,7 +116,7 @@ class TestHeap(unittest.TestCase):
             max_heap_insert(heap, i)
             
         self.assertEqual(len(heap), 10)
-        expected = [9, 8, 7, 5, 6, 2, 1, 4, 0, 3]
+        expected = [9, 8, 5, 6, 7, 1, 4, 0, 3, 2]
         self.assertListEqual(heap, expected)
         self.assertTrue(satisfies_heap_property(heap))
         
@@ -105,6 +158,798 @@ class TestHeap(unittest.TestCase):
         
         self.assertListEqual(expected, lst)
 
+    def test_heapsort_cases(self):
+        """
+        Tests heapsort on sorted, reverse sorted and few-unique
+        input of various sizes.
+        """
+        for n in range(50):
+            cases = [
+                list(range(n)),
+                list(range(n, 0, -1)),
+                [random.randint(0, 3) for i in range(n)],
+            ]
+            for numbers in cases:
+                lst = numbers[:]
+                heapsort(lst)
+
+                self.assertListEqual(sorted(numbers), lst)
+
+    def test_build_then_extract(self):
+        lst = [random.randint(0, 20) for i in range(100)]
+        heap = lst[:]
+        build_max_heap(heap)
+        self.assertTrue(satisfies_heap_property(heap))
+
+        observed = [heap_extract_max(heap) for i in range(len(lst))]
+
+        self.assertListEqual(sorted(lst, reverse=True), observed)
+        self.assertRaises(ValueError, heap_extract_max, heap)
+
+    def test_insert_then_extract(self):
+        lst = [random.randint(0, 20) for i in range(100)]
+        heap = []
+        for key in lst:
+            max_heap_insert(heap, key)
+            self.assertTrue(satisfies_heap_property(heap))
+
+        observed = [heap_extract_max(heap) for i in range(len(lst))]
+
+        self.assertListEqual(sorted(lst, reverse=True), observed)
+
+
+class TestSelection(unittest.TestCase):
+    def test_iter_sorted(self):
+        for n in range(20):
+            numbers = [random.randint(0, 10) for i in range(n)]
+
+            self.assertListEqual(sorted(numbers), list(iter_sorted(numbers)))
+            self.assertListEqual(sorted(numbers, reverse=True),
+                                 list(iter_sorted(numbers, reverse=True)))
+
+    def test_iter_sorted_is_lazy(self):
+        numbers = [random.random() for i in range(1000)]
+
+        it = iter_sorted(numbers)
+        first = [next(it) for i in range(10)]
+
+        self.assertListEqual(sorted(numbers)[:10], first)
+
+    def test_top_k(self):
+        numbers = [random.random() for i in range(1000)]
+
+        for k in [0, 1, 10, 1000, 2000]:
+            observed = top_k(iter(numbers), k)
+
+            self.assertListEqual(sorted(numbers, reverse=True)[:k], observed)
+
+    def test_top_k_key(self):
+        words = ['%x' % random.randint(0, 2 ** 32) for i in range(100)]
+
+        observed = top_k(words, 5, key=len)
+
+        self.assertListEqual([len(w) for w in observed],
+                             sorted(map(len, words), reverse=True)[:5])
+
+
+class TestBulkHeapOperations(unittest.TestCase):
+    def test_heap_pushpop(self):
+        heap = [random.randint(0, 50) for i in range(100)]
+        build_max_heap(heap)
+        expected = heap[:]
+
+        for i in range(100):
+            key = random.randint(0, 60)
+            max_heap_insert(expected, key)
+            self.assertEqual(heap_extract_max(expected), heap_pushpop(heap, key))
+            self.assertTrue(satisfies_heap_property(heap))
+
+        self.assertListEqual(sorted(expected), sorted(heap))
+        self.assertEqual(heap_pushpop([], 3), 3)
+
+    def test_heap_replace(self):
+        heap = [7, 6, 4, 5]
+
+        self.assertEqual(heap_replace(heap, 10), 7)
+        self.assertEqual(heap[0], 10)
+
+        self.assertEqual(heap_replace(heap, 1), 10)
+        self.assertTrue(satisfies_heap_property(heap))
+        self.assertListEqual(sorted(heap), [1, 4, 5, 6])
+
+        self.assertRaises(ValueError, heap_replace, [], 1)
+
+    def test_heap_extend(self):
+        for n, k in [(0, 10), (1000, 3), (10, 1000), (100, 0)]:
+            heap = [random.random() for i in range(n)]
+            build_max_heap(heap)
+            keys = [random.random() for i in range(k)]
+            expected = sorted(heap + keys)
+
+            heap_extend(heap, iter(keys))
+
+            self.assertTrue(satisfies_heap_property(heap))
+            self.assertListEqual(expected, sorted(heap))
+
+    def test_heap_meld(self):
+        heap1 = [random.random() for i in range(50)]
+        heap2 = [random.random() for i in range(70)]
+        build_max_heap(heap1)
+        build_max_heap(heap2)
+        expected = sorted(heap1 + heap2, reverse=True)
+
+        heap_meld(heap1, heap2)
+
+        self.assertEqual(len(heap2), 70)
+        observed = [heap_extract_max(heap1) for i in range(120)]
+        self.assertListEqual(expected, observed)
+
+
+class TestSortedList(unittest.TestCase):
+    def test_init(self):
+        numbers = [random.randint(0, 100) for i in range(500)]
+
+        sl = SortedList(numbers, load=16)
+
+        self.assertEqual(len(sl), 500)
+        self.assertListEqual(sorted(numbers), list(sl))
+        self.assertRaises(ValueError, SortedList, [], 0)
+
+    def test_random_operations(self):
+        """
+        Applies random inserts, removals and queries and checks the
+        container against a plain sorted list.
+        """
+        for load in [1, 4, 32]:
+            sl = SortedList(load=load)
+            expected = []
+            for i in range(2000):
+                value = random.randint(0, 100)
+                op = random.random()
+                if op < 0.45:
+                    sl.add(value)
+                    insort(expected, value)
+                elif op < 0.6:
+                    if value in expected:
+                        sl.remove(value)
+                        expected.remove(value)
+                    else:
+                        self.assertRaises(ValueError, sl.remove, value)
+                elif op < 0.7 and expected:
+                    index = random.randint(-len(expected), len(expected) - 1)
+                    self.assertEqual(expected.pop(index), sl.pop(index))
+                elif expected:
+                    index = random.randint(-len(expected), len(expected) - 1)
+                    self.assertEqual(expected[index], sl[index])
+                    self.assertEqual(bisect_left(expected, value),
+                                     sl.bisect_left(value))
+                    self.assertEqual(bisect_right(expected, value),
+                                     sl.bisect_right(value))
+                    self.assertEqual(value in expected, value in sl)
+
+                self.assertEqual(len(expected), len(sl))
+
+            self.assertListEqual(expected, list(sl))
+
+    def test_irange(self):
+        numbers = [random.randint(0, 100) for i in range(300)]
+        sl = SortedList(numbers, load=8)
+        expected = sorted(numbers)
+
+        self.assertListEqual([x for x in expected if 20 <= x <= 60],
+                             list(sl.irange(20, 60)))
+        self.assertListEqual([x for x in expected if 20 < x < 60],
+                             list(sl.irange(20, 60, inclusive=(False, False))))
+        self.assertListEqual([x for x in expected if x <= 30],
+                             list(sl.irange(maximum=30)))
+        self.assertListEqual([], list(sl.irange(60, 20)))
+
+    def test_index_count(self):
+        sl = SortedList([5, 1, 3, 3, 3, 9], load=2)
+
+        self.assertEqual(sl.index(3), 1)
+        self.assertEqual(sl.count(3), 3)
+        self.assertEqual(sl.count(4), 0)
+        self.assertRaises(ValueError, sl.index, 4)
+        self.assertRaises(IndexError, sl.__getitem__, 6)
+
+        sl.discard(4)
+        sl.discard(3)
+        self.assertListEqual([1, 3, 3, 5, 9], list(sl))
+
+
+class TestDaryHeap(unittest.TestCase):
+    def test_push_pop(self):
+        for d in [2, 3, 4, 8]:
+            numbers = [random.randint(0, 50) for i in range(200)]
+            heap = DaryHeap(d)
+            for key in numbers:
+                heap.push(key)
+
+            self.assertEqual(len(heap), len(numbers))
+            self.assertEqual(heap.peek(), max(numbers))
+
+            observed = [heap.pop() for i in range(len(numbers))]
+
+            self.assertListEqual(sorted(numbers, reverse=True), observed)
+            self.assertRaises(ValueError, heap.pop)
+
+    def test_heapify(self):
+        for d in [2, 4, 8]:
+            for n in range(30):
+                numbers = [random.random() for i in range(n)]
+                heap = DaryHeap(d, numbers)
+
+                observed = [heap.pop() for i in range(n)]
+
+                self.assertListEqual(sorted(numbers, reverse=True), observed)
+
+    def test_invalid_arity(self):
+        self.assertRaises(ValueError, DaryHeap, 1)
+
+
+class TestIndexedPriorityQueue(unittest.TestCase):
+    def test_push_pop(self):
+        for max_heap in [True, False]:
+            pq = IndexedPriorityQueue(max_heap=max_heap)
+            priorities = [random.random() for i in range(100)]
+            for handle, priority in enumerate(priorities):
+                pq.push(handle, priority)
+
+            self.assertEqual(len(pq), 100)
+            self.assertIn(5, pq)
+            self.assertRaises(ValueError, pq.push, 5, 0.5)
+
+            observed = [pq.pop()[1] for i in range(100)]
+
+            self.assertListEqual(sorted(priorities, reverse=max_heap),
+                                 observed)
+            self.assertEqual(len(pq), 0)
+            self.assertRaises(ValueError, pq.pop)
+
+    def test_update_remove(self):
+        """
+        Applies random updates and removals and checks the queue
+        against a dictionary of expected priorities.
+        """
+        pq = IndexedPriorityQueue(max_heap=False)
+        expected = dict()
+        for handle in range(200):
+            expected[handle] = random.randint(0, 1000)
+            pq.push(handle, expected[handle])
+
+        for i in range(500):
+            handle = random.choice(list(expected))
+            if random.random() < 0.2:
+                self.assertEqual(pq.remove(handle), expected.pop(handle))
+                self.assertFalse(pq.contains(handle))
+            else:
+                expected[handle] = random.randint(0, 1000)
+                pq.update(handle, expected[handle])
+                self.assertEqual(pq.get_priority(handle), expected[handle])
+
+        self.assertRaises(KeyError, pq.update, -1, 0)
+        self.assertRaises(KeyError, pq.remove, -1)
+
+        observed = []
+        while len(pq):
+            handle, priority = pq.pop()
+            self.assertEqual(expected[handle], priority)
+            observed.append(priority)
+
+        self.assertListEqual(sorted(expected.values()), observed)
+
+
+class TestNaturalMergeSort(unittest.TestCase):
+    def test_natural_merge_sort_cases(self):
+        """
+        Tests natural merge sort on random, sorted, reverse
+        sorted, nearly sorted and few-unique input.
+        """
+        n = 1000
+        cases = [
+            [random.random() for i in range(n)],
+            sorted(random.random() for i in range(n)),
+            sorted((random.random() for i in range(n)), reverse=True),
+            list(range(n)) + [random.randint(0, n) for i in range(20)],
+            [random.randint(0, 3) for i in range(n)],
+            [i % 37 for i in range(n)],
+        ]
+        for numbers in cases:
+            observed = numbers[:]
+            natural_merge_sort(observed, 0, len(observed) - 1)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+    def test_natural_merge_sort_subrange(self):
+        numbers = [random.random() for i in range(200)]
+
+        observed = numbers[:]
+        natural_merge_sort(observed, 20, 149)
+
+        expected = numbers[:20] + sorted(numbers[20:150]) + numbers[150:]
+        self.assertListEqual(expected, observed)
+
+    def test_natural_merge_sort_stable(self):
+        pairs = [(random.randint(0, 5), i) for i in range(500)]
+        keys = [CountingKey(k, i) for k, i in pairs]
+
+        natural_merge_sort(keys, 0, len(keys) - 1)
+
+        observed = [(key.k, key.i) for key in keys]
+        expected = sorted(pairs, key=lambda pair: pair[0])
+        self.assertListEqual(expected, observed)
+
+    def test_natural_merge_sort_adaptive(self):
+        """
+        Sorted and reverse sorted input are single runs and
+        need n - 1 comparisons. A short unsorted tail should
+        only add a small amount of work.
+        """
+        n = 10000
+        cases = [
+            list(range(n)),
+            list(range(n, 0, -1)),
+            list(range(n)) + [random.randint(0, n) for i in range(50)],
+        ]
+        for numbers in cases:
+            keys = [CountingKey(k) for k in numbers]
+            CountingKey.comparisons = 0
+            natural_merge_sort(keys, 0, len(keys) - 1)
+
+            self.assertLess(CountingKey.comparisons, 2 * len(keys))
+            self.assertListEqual(sorted(numbers), [key.k for key in keys])
+
+
+class TestParallelMergeSort(unittest.TestCase):
+    def test_parallel_merge_sort_shared(self):
+        """
+        Tests parallel merge sort on floats and ints, which are
+        passed to the workers through shared memory.
+        """
+        cases = [
+            [random.random() for i in range(5000)],
+            [random.randint(-2 ** 40, 2 ** 40) for i in range(5000)],
+        ]
+        for numbers in cases:
+            observed = numbers[:]
+            parallel_merge_sort(observed, workers=3, threshold=100)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+    def test_parallel_merge_sort_pickled(self):
+        """
+        Tests parallel merge sort on values that do not fit in
+        a typed shared buffer.
+        """
+        cases = [
+            [str(random.random()) for i in range(5000)],
+            [random.randint(0, 2 ** 70) for i in range(5000)],
+        ]
+        for numbers in cases:
+            observed = numbers[:]
+            parallel_merge_sort(observed, workers=3, threshold=100)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+    def test_parallel_merge_sort_small(self):
+        """
+        Lists below the threshold are sorted serially.
+        """
+        for n in range(5):
+            numbers = [random.random() for i in range(n)]
+
+            observed = numbers[:]
+            parallel_merge_sort(observed, workers=4)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+
+class TestNonComparisonSorts(unittest.TestCase):
+    def test_counting_sort(self):
+        for n in range(50):
+            numbers = [random.randint(-10, 10) for i in range(n)]
+
+            observed = numbers[:]
+            counting_sort(observed)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+        self.assertRaises(TypeError, counting_sort, [1, 2.0])
+
+    def test_radix_sort_ints(self):
+        cases = [
+            [random.randint(-1000, 1000) for i in range(1000)],
+            [random.randint(-2 ** 63, 2 ** 63 - 1) for i in range(1000)],
+            [random.randint(0, 2 ** 100) for i in range(100)],
+            [],
+            [7],
+        ]
+        for numbers in cases:
+            observed = numbers[:]
+            radix_sort(observed)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+    def test_radix_sort_floats(self):
+        """
+        Tests that the order-preserving bit transform handles
+        negative values, signed zeros, subnormals and infinities.
+        """
+        numbers = [random.uniform(-1e6, 1e6) for i in range(1000)]
+        numbers += [0.0, -0.0, 5e-324, -5e-324, float('inf'), -float('inf')]
+        random.shuffle(numbers)
+
+        observed = numbers[:]
+        radix_sort(observed)
+
+        self.assertListEqual(sorted(numbers), observed)
+        self.assertRaises(TypeError, radix_sort, [1, 2.0])
+
+    def test_auto_sort_radix_min_n(self):
+        """
+        Tests that 32-bit ints only go to radix sort from
+        _RADIX_MIN_N elements on.
+        """
+        for n, expected in [(sorting._RADIX_MIN_N - 1, 'merge'),
+                            (sorting._RADIX_MIN_N, 'radix')]:
+            numbers = [random.randrange(2 ** 31) for i in range(n)]
+
+            self.assertEqual(expected, sorting._choose_by_type(numbers))
+
+            observed = numbers[:]
+            auto_sort(observed)
+            self.assertListEqual(sorted(numbers), observed)
+
+    def test_auto_sort(self):
+        cases = [
+            [random.randint(0, 100) for i in range(1000)],
+            [random.randint(0, 2 ** 20) for i in range(1000)],
+            [random.random() for i in range(1000)],
+            [str(random.random()) for i in range(1000)],
+            [random.random() for i in range(5)],
+        ]
+        for numbers in cases:
+            observed = numbers[:]
+            auto_sort(observed)
+
+            self.assertListEqual(sorted(numbers), observed)
+
+
+class TestSortFrontEnd(unittest.TestCase):
+    def test_sort_cases(self):
+        n = 3000
+        cases = [
+            [random.random() for i in range(n)],
+            list(range(n)),
+            list(range(n, 0, -1)),
+            [random.randint(0, 100) for i in range(n)],
+            [str(random.random()) for i in range(n)],
+            [3, 1, 2],
+            [],
+        ]
+        for numbers in cases:
+            for reverse in [False, True]:
+                observed = numbers[:]
+                sort(observed, reverse=reverse)
+
+                self.assertListEqual(sorted(numbers, reverse=reverse), observed)
+
+    def test_sort_key_stable(self):
+        for n in [10, 3000]:
+            pairs = [(random.randint(0, 3), i) for i in range(n)]
+            for reverse in [False, True]:
+                observed = pairs[:]
+                decision = sort(observed, key=lambda pair: pair[0],
+                                reverse=reverse)
+
+                expected = sorted(pairs, key=lambda pair: pair[0],
+                                  reverse=reverse)
+                self.assertListEqual(expected, observed)
+                self.assertTrue(decision.keyed)
+
+    def test_sort_parallel_opt_in(self):
+        """
+        Tests that large lists only go to parallel_merge_sort when
+        several workers are asked for.
+        """
+        numbers = [str(random.random()) for i in range(3000)]
+        with mock.patch.object(sorting, '_PARALLEL_THRESHOLD', 1000):
+            observed = numbers[:]
+            decision = sort(observed)
+            self.assertEqual(decision.algorithm, 'natural merge')
+
+            observed = numbers[:]
+            decision = sort(observed, workers=2)
+            self.assertEqual(decision.algorithm, 'parallel merge')
+            self.assertListEqual(sorted(numbers), observed)
+
+            decision = sort(numbers[:999], workers=2)
+            self.assertEqual(decision.algorithm, 'natural merge')
+
+    def test_sort_typed(self):
+        buf = array('d', [random.random() for i in range(100)])
+
+        decision = sort(buf, reverse=True)
+
+        self.assertEqual(decision.algorithm, 'typed')
+        self.assertListEqual(sorted(buf, reverse=True), list(buf))
+
+    def test_sort_decisions(self):
+        """
+        Tests that presorted input is routed to natural merge sort
+        and narrow-range ints to counting sort, and that decisions
+        are logged.
+        """
+        n = 3000
+        with self.assertLogs('sorting', level='DEBUG') as logs:
+            decision = sort(list(range(n)))
+        self.assertEqual(decision.algorithm, 'natural merge')
+        self.assertEqual(decision.descent_ratio, 0.0)
+        self.assertIn('natural merge', logs.output[0])
+
+        decision = sort(list(range(n, 0, -1)))
+        self.assertEqual(decision.algorithm, 'natural merge')
+
+        decision = sort([random.randint(0, 100) for i in range(n)])
+        self.assertEqual(decision.algorithm, 'counting')
+        self.assertEqual(decision.element_type, 'int')
+
+
+class TestKeyFunctions(unittest.TestCase):
+    def setUp(self):
+        self.records = [(random.randint(-5, 5), i) for i in range(1000)]
+        self.key_calls = 0
+
+    def first(self, record):
+        self.key_calls += 1
+        return record[0]
+
+    def test_sorts_with_key(self):
+        """
+        Tests that every sort orders records by key, keeps equal
+        keys in their original order and computes each key once.
+        """
+        sorts = [
+            lambda lst, key: insertion_sort(lst, key=key),
+            lambda lst, key: merge_sort(lst, 0, len(lst) - 1, key=key),
+            lambda lst, key: natural_merge_sort(lst, 0, len(lst) - 1, key=key),
+            lambda lst, key: heapsort(lst, key=key),
+            lambda lst, key: parallel_merge_sort(lst, workers=2, threshold=100,
+                                                 key=key),
+            lambda lst, key: counting_sort(lst, key=key),
+            lambda lst, key: radix_sort(lst, key=key),
+            lambda lst, key: auto_sort(lst, key=key),
+        ]
+        expected = sorted(self.records, key=lambda record: record[0])
+        for sort_with_key in sorts:
+            self.key_calls = 0
+            observed = self.records[:]
+            sort_with_key(observed, self.first)
+
+            self.assertListEqual(expected, observed)
+            self.assertEqual(self.key_calls, len(self.records))
+
+    def test_external_merge_sort_with_key(self):
+        observed = external_merge_sort(iter(self.records), chunk_size=100,
+                                       max_runs=4, key=self.first)
+
+        expected = sorted(self.records, key=lambda record: record[0])
+        self.assertListEqual(expected, list(observed))
+        self.assertEqual(self.key_calls, len(self.records))
+
+    def test_merge_sort_subrange_with_key(self):
+        observed = self.records[:]
+        merge_sort(observed, 100, 799, key=self.first)
+
+        expected = (self.records[:100]
+                    + sorted(self.records[100:800], key=lambda record: record[0])
+                    + self.records[800:])
+        self.assertListEqual(expected, observed)
+
+    def test_argsort(self):
+        self.assertListEqual(argsort([3, 1, 2]), [1, 2, 0])
+        self.assertListEqual(argsort([3, 1, 2], reverse=True), [0, 2, 1])
+        self.assertListEqual(argsort([]), [])
+
+        for key in [self.first, lambda record: str(record[0]),
+                    lambda record: float(record[0])]:
+            for reverse in [False, True]:
+                perm = argsort(self.records, key=key, reverse=reverse)
+
+                expected = sorted(self.records, key=key, reverse=reverse)
+                self.assertListEqual(expected, [self.records[i] for i in perm])
+
+
+class TestTypedBuffers(unittest.TestCase):
+    def test_array_sorts(self):
+        """
+        Tests that insertion sort, merge sort and heapsort sort
+        array.array buffers in place.
+        """
+        for typecode in ['d', 'i', 'q']:
+            if typecode == 'd':
+                numbers = [random.random() for i in range(300)]
+            else:
+                numbers = [random.randint(-1000, 1000) for i in range(300)]
+            expected = array(typecode, sorted(numbers))
+
+            for sort in [insertion_sort, heapsort,
+                         lambda buf: merge_sort(buf, 0, len(buf) - 1)]:
+                buf = array(typecode, numbers)
+                sort(buf)
+
+                self.assertEqual(expected, buf)
+
+    def test_array_merge_sort_subrange(self):
+        numbers = [random.random() for i in range(100)]
+        buf = array('d', numbers)
+
+        merge_sort(buf, 10, 89)
+
+        expected = numbers[:10] + sorted(numbers[10:90]) + numbers[90:]
+        self.assertEqual(array('d', expected), buf)
+
+    @unittest.skipIf(np is None, 'NumPy is not installed')
+    def test_numpy_sorts(self):
+        numbers = np.random.random(300)
+
+        for sort in [insertion_sort, heapsort,
+                     lambda buf: merge_sort(buf, 0, len(buf) - 1)]:
+            buf = numbers.copy()
+            sort(buf)
+
+            self.assertTrue(np.array_equal(np.sort(numbers), buf))
+
+        buf = numbers.copy()
+        merge_sort(buf, 10, 89)
+        expected = numbers.copy()
+        expected[10:90] = np.sort(numbers[10:90])
+        self.assertTrue(np.array_equal(expected, buf))
+
+        self.assertRaises(ValueError, heapsort, np.zeros((3, 3)))
+
+
+class TestExternalMergeSort(unittest.TestCase):
+    def test_external_merge_sort_spilled(self):
+        """
+        Tests external merge sort on a stream that is spilled to
+        several runs, including merging runs once max_runs is hit.
+        """
+        numbers = [random.random() for i in range(1050)]
+
+        for max_runs in [4, 64]:
+            observed = external_merge_sort(iter(numbers), chunk_size=100,
+                                           max_runs=max_runs)
+
+            self.assertListEqual(sorted(numbers), list(observed))
+
+    def test_external_merge_sort_levels(self):
+        """
+        Tests that runs are merged in levels, so each element is
+        spilled once per level rather than once per merge.
+        """
+        spill = sorting._spill_run
+        written = []
+
+        def counting_spill(items, tmpdir):
+            items = list(items)
+            written.append(len(items))
+            return spill(items, tmpdir)
+
+        # 27 chunks of 10 make three levels of merges with max_runs=3
+        for n in [270, 275]:
+            numbers = [random.random() for i in range(n)]
+            written.clear()
+
+            with mock.patch.object(sorting, '_spill_run', counting_spill):
+                observed = list(external_merge_sort(numbers, chunk_size=10,
+                                                    max_runs=3))
+
+            self.assertListEqual(sorted(numbers), observed)
+            self.assertLessEqual(sum(written), 4 * n)
+
+        with self.assertRaises(ValueError):
+            list(external_merge_sort(numbers, max_runs=1))
+
+    def test_external_merge_sort_stable(self):
+        pairs = [(random.randint(0, 5), i) for i in range(500)]
+        keys = [CountingKey(k, i) for k, i in pairs]
+
+        observed = external_merge_sort(keys, chunk_size=64, max_runs=3)
+
+        expected = sorted(pairs, key=lambda pair: pair[0])
+        self.assertListEqual(expected, [(key.k, key.i) for key in observed])
+
+    def test_external_merge_sort_in_memory(self):
+        """
+        Streams that fit in one chunk, including empty ones and ones
+        of exactly chunk_size elements, are sorted without spilling.
+        """
+        for n in [0, 1, 99, 100]:
+            numbers = [random.random() for i in range(n)]
+
+            with mock.patch.object(sorting, '_spill_run') as spill:
+                observed = list(external_merge_sort(numbers, chunk_size=100))
+
+            self.assertListEqual(sorted(numbers), observed)
+            spill.assert_not_called()
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_instrument_counts_merge_sort(self):
+        numbers = [random.random() for i in range(200)]
+        lst = numbers[:]
+
+        with sorting.instrument() as stats:
+            sorting.merge_sort(lst, 0, len(lst) - 1)
+
+        self.assertListEqual(sorted(numbers), lst)
+        self.assertGreater(stats.comparisons, 0)
+        self.assertGreater(stats.moves, 0)
+        self.assertGreater(stats.allocations, 0)
+        self.assertEqual(1, stats.calls['merge_sort'])
+
+    def test_instrument_counts_insertion_sort(self):
+        """
+        Insertion sort on reversed input compares every pair once.
+        """
+        n = 50
+        lst = list(range(n, 0, -1))
+
+        with sorting.instrument() as stats:
+            sorting.insertion_sort(lst)
+
+        self.assertListEqual(list(range(1, n + 1)), lst)
+        self.assertEqual(n * (n - 1) // 2, stats.comparisons)
+        self.assertEqual(0, stats.allocations)
+
+    def test_instrument_depth(self):
+        lst = [random.random() for i in range(100)]
+
+        with sorting.instrument() as stats:
+            sorting.heapsort(lst)
+
+        self.assertListEqual(sorted(lst), lst)
+        self.assertEqual(2, stats.max_depth)
+        self.assertGreater(stats.calls['_max_heapify'], 1)
+
+    def test_instrument_callback(self):
+        calls = []
+        a = [1, 3, 5, 2, 4, 6]
+
+        with sorting.instrument(lambda name, stats: calls.append(name)):
+            sorting.merge(a, 0, 2, 5)
+
+        self.assertListEqual([1, 2, 3, 4, 5, 6], a)
+        self.assertListEqual(['merge'], calls)
+
+    def test_instrument_not_nested(self):
+        with sorting.instrument():
+            with self.assertRaises(RuntimeError):
+                with sorting.instrument():
+                    pass
+
+        # usable again once closed
+        with sorting.instrument() as stats:
+            sorting.insertion_sort([2, 1])
+        self.assertEqual(1, stats.comparisons)
+
+    def test_instrument_restores(self):
+        """
+        The original functions are put back on exit, even after an error.
+        """
+        originals = [sorting.merge_sort, sorting.heapsort,
+                     sorting._max_heapify]
+
+        with self.assertRaises(TypeError):
+            with sorting.instrument():
+                sorting.heapsort([1, 'a', 2])
+
+        self.assertListEqual(originals, [sorting.merge_sort,
+                                         sorting.heapsort,
+                                         sorting._max_heapify])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,19 @@
+from array import array
+from bisect import bisect_left
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import copy
+import mmap
+import os
+import struct
 import sys
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class DiGraph:
@@ -87,6 +100,321 @@ class DiGraph:
         return edges
 
 
+    def freeze(self):
+        """
+        Converts the graph to an immutable CSRGraph with the same
+        vertices and edges. Vertices are numbered in the order they
+        were added to this graph.
+        """
+        names = list(self._edges)
+        ids = {v: i for i, v in enumerate(names)}
+
+        offsets = array('q', [0])
+        neighbors = array(_id_typecode(len(names)))
+        for u in names:
+            neighbors.extend(sorted(ids[v] for v in self._edges[u]))
+            offsets.append(len(neighbors))
+
+        return CSRGraph(offsets, neighbors, names)
+
+
+    def to_undirected(self):
+        """
+        Returns a Graph with the same vertices and an undirected edge
+        for every pair of vertices joined by an edge in either
+        direction.
+        """
+        G = Graph()
+        for u, neighbors in self._edges.items():
+            G.add_vertex(u)
+            for v in neighbors:
+                G.add_edge(u, v)
+
+        return G
+
+
+class Graph:
+    """
+    Implements an undirected graph.
+
+    Vertices can be any hashable object (e.g., number, string, tuple).
+
+    Each edge is stored once, in the set of whichever of its two
+    vertices was added to the graph first, so a symmetric relation such
+    as friendship takes half the space of a DiGraph holding both
+    directions.  Edge queries are symmetric: edge_exists(u, v) is
+    edge_exists(v, u).
+
+    Listing the neighbors of a vertex needs the edges stored at the
+    other end as well, so get_neighbors reads them from the CSRGraph
+    built by the first call, which has both directions of each edge.
+    Edges added after that are also kept in both directions until the
+    next freeze(), so a neighbor query takes O(degree) time however
+    changes and queries are interleaved.  The search functions work on
+    freeze(), which rebuilds the CSRGraph in O(V + E) time if the graph
+    has changed since it was last built.
+    """
+    def __init__(self):
+        self._edges = dict()
+        self._order = dict()
+        self._frozen = None
+        # edges added since _frozen was built, in both directions
+        self._added = dict()
+
+
+    def add_vertex(self, v):
+        """
+        Adds the given vertex v. If v is already in the
+        graph, it isn't added again.
+        """
+        if v not in self._order:
+            self._order[v] = len(self._order)
+            self._edges[v] = set()
+
+
+    def add_edge(self, u, v):
+        """
+        Adds an edge between vertices u and v.  If the edge is
+        already in the graph, it isn't added again.  If u or
+        v are not present in the graph, they are added.
+        """
+        self.add_vertex(u)
+        self.add_vertex(v)
+        if self._order[u] > self._order[v]:
+            u, v = v, u
+        if v not in self._edges[u]:
+            self._edges[u].add(v)
+            if self._frozen is not None:
+                self._added.setdefault(u, set()).add(v)
+                self._added.setdefault(v, set()).add(u)
+
+
+    def vertex_exists(self, u):
+        """
+        Returns true if u is in the graph, false otherwise.
+        """
+        return u in self._order
+
+
+    def edge_exists(self, u, v):
+        """
+        Returns true if there is an edge between u and v in the graph, false
+        otherwise.  If u or v are not in the graph, false is returned.
+        """
+        if u not in self._order or v not in self._order:
+            return False
+        if self._order[u] > self._order[v]:
+            u, v = v, u
+
+        return v in self._edges[u]
+
+
+    def get_neighbors(self, u):
+        """
+        Returns a collection of the vertices joined to u by an edge.
+        Raises KeyError if u is not in the graph.
+        """
+        i = self._order[u]
+        if self._frozen is None:
+            self.freeze()
+
+        G = self._frozen
+        neighbors = []
+        if i < G.count_vertices():
+            neighbors = [G.names[j] for j in G.neighbor_ids(i)]
+        if u in self._added:
+            neighbors.extend(self._added[u])
+
+        return neighbors
+
+
+    def count_vertices(self):
+        """
+        Counts the number of vertices in the graph
+        """
+        return len(self._edges)
+
+
+    def count_edges(self):
+        """
+        Counts the number of edges in the graph, each once
+        """
+        return sum(map(len, self._edges.values()))
+
+
+    def edge_set(self):
+        """Get a set of all edges in the graph.
+
+        Each edge is represented as a frozenset of its two vertices
+        (or one, for an edge from a vertex to itself)
+
+        Returns:
+            set<frozenset<vertex>>: Set of all edges
+        """
+        edges = set()
+        for u, neighbors in self._edges.items():
+            for v in neighbors:
+                edges.add(frozenset((u, v)))
+
+        return edges
+
+
+    def freeze(self):
+        """
+        Returns an immutable CSRGraph with the same vertices and an
+        edge in both directions for each edge of this graph, numbering
+        the vertices in the order they were added.  It is built again
+        only if the graph has changed since the last call.
+        """
+        if (self._frozen is not None and not self._added
+                and self._frozen.count_vertices() == len(self._order)):
+            return self._frozen
+
+        rows = [[] for _ in self._order]
+        order = self._order
+        for u, neighbors in self._edges.items():
+            i = order[u]
+            for v in neighbors:
+                j = order[v]
+                rows[i].append(j)
+                if j != i:
+                    rows[j].append(i)
+
+        offsets = array('q', [0])
+        neighbors = array(_id_typecode(len(rows)))
+        for row in rows:
+            neighbors.extend(sorted(row))
+            offsets.append(len(neighbors))
+
+        G = CSRGraph(offsets, neighbors, list(self._edges))
+        if self._frozen is not None:
+            G._bfs_touched = self._frozen._bfs_touched
+        self._frozen = G
+        self._added = dict()
+        return G
+
+
+class CSRGraph:
+    """
+    Implements an immutable directed graph in compressed sparse row form.
+
+    Vertices are numbered 0 to n - 1 and names maps each number back to
+    the vertex it stands for, which can be any hashable object.  The
+    edges leaving vertex i go to the vertices numbered
+    neighbors[offsets[i]:offsets[i+1]], in increasing order.  offsets
+    and neighbors are flat arrays of machine integers (array.array,
+    NumPy arrays or memoryviews), so an edge costs a few bytes rather
+    than a set entry.
+
+    Use DiGraph.freeze(), load_graph or open_graph to get one.  Methods
+    that take or return vertices use the names; the *_id methods work
+    on the numbers.
+    """
+    def __init__(self, offsets, neighbors, names):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.names = names
+        # built on first use, as graphs opened with open_graph may
+        # never look vertices up by name
+        self._id_table = None
+        # Vertex objects the last bfs or recommend_friends_for_user
+        # wrote to, reset by the next one
+        self._bfs_touched = []
+
+
+    def _ids(self):
+        """
+        Returns a dictionary mapping each vertex to its number.
+        """
+        if self._id_table is None:
+            self._id_table = {v: i for i, v in enumerate(self.names)}
+
+        return self._id_table
+
+
+    def vertex_id(self, u):
+        """
+        Returns the number of vertex u.  Raises KeyError if u is not
+        in the graph.
+        """
+        return self._ids()[u]
+
+
+    def vertex_exists(self, u):
+        """
+        Returns true if u is in the graph, false otherwise.
+        """
+        return u in self._ids()
+
+
+    def edge_exists(self, u, v):
+        """
+        Returns true if there is an edge from u to v in the graph, false otherwise.
+        If u or v are not in the graph, false is returned.
+        """
+        ids = self._ids()
+        if u not in ids or v not in ids:
+            return False
+
+        i, j = ids[u], ids[v]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        k = bisect_left(self.neighbors, j, lo, hi)
+        return k < hi and self.neighbors[k] == j
+
+
+    def neighbor_ids(self, i):
+        """
+        Returns the numbers of the vertices that vertex number i has
+        edges to, as a slice of the neighbors array.
+        """
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+
+    def get_outgoing_edges(self, u):
+        """
+        Returns a collection of edges starting at vertex u.
+        """
+        return [self.names[j] for j in self.neighbor_ids(self.vertex_id(u))]
+
+
+    def count_vertices(self):
+        """
+        Counts the number of vertices in the graph
+        """
+        return len(self.names)
+
+
+    def count_edges(self):
+        """
+        Counts the number of edges in the graph
+        """
+        return len(self.neighbors)
+
+
+    def edge_set(self):
+        """Get a set of all edges in the graph.
+
+        Each edge is represented as a tuple of (start, end)
+
+        Returns:
+            set<tuple<vertex, vertex>>: Set of all edges
+        """
+        edges = set()
+        for i, start_vertex in enumerate(self.names):
+            for j in self.neighbor_ids(i):
+                edges.add((start_vertex, self.names[j]))
+
+        return edges
+
+
+def _id_typecode(n_vertices):
+    """
+    Returns the array typecode used to store vertex numbers
+    for a graph with n_vertices vertices.
+    """
+    return 'i' if n_vertices < 2**31 else 'q'
+
+
 class Vertex:
     """
     Models vertices in a graph.  The pi, color, and d attributes
@@ -101,6 +429,10 @@ class Vertex:
         self.name = name
 
 
+# Characters read from an edge list at a time
+_CHUNK_SIZE = 1 << 20
+
+
 def load_data(training_flname, testing_flname):
     """
     Loads the training and testing set data. Returns
@@ -110,41 +442,317 @@ def load_data(training_flname, testing_flname):
     # for the same user.  We will check the dictionary for
     # an existing Vertex object before creating another
     vertices = dict()
-    with open(training_flname) as fl:
-        G1 = DiGraph()
-        for ln in fl:
-            cols = ln.split()
-            if cols[0] not in vertices:
-                vertices[cols[0]] = Vertex(name=cols[0])
-            if cols[1] not in vertices:
-                vertices[cols[1]] = Vertex(name=cols[1])
-            u = vertices[cols[0]]
-            v = vertices[cols[1]]
-            G1.add_edge(u, v)
-            
-    with open(testing_flname) as fl:
-        G2 = DiGraph()
-        for ln in fl:
-            cols = ln.split()
-            if cols[0] not in vertices:
-                vertices[cols[0]] = Vertex(name=cols[0])
-            if cols[1] not in vertices:
-                vertices[cols[1]] = Vertex(name=cols[1])
-            u = vertices[cols[0]]
-            v = vertices[cols[1]]
-            G2.add_edge(u, v)
+    G1 = _load_digraph(training_flname, vertices)
+    G2 = _load_digraph(testing_flname, vertices)
 
     return G1, G2
 
+
+def _load_digraph(flname, vertices):
+    """
+    Loads an edge list into a DiGraph, looking up and adding
+    Vertex objects by name in the dictionary vertices.
+    """
+    G = DiGraph()
+    for sources, targets in _read_edges(flname):
+        for u, v in zip(sources, targets):
+            if u not in vertices:
+                vertices[u] = Vertex(name=u)
+            if v not in vertices:
+                vertices[v] = Vertex(name=v)
+            G.add_edge(vertices[u], vertices[v])
+
+    return G
+
+
+def load_graph(flname, cache=True):
+    """
+    Loads an edge list, one edge per line given as two whitespace
+    separated vertex names, into a CSRGraph whose vertices are the
+    names as strings.  Any further fields on a line are ignored.
+
+    The file is read in large chunks, and the names are numbered
+    straight into integer arrays that the CSR arrays are then built
+    from in bulk.  With NumPy, the result is also written to a cache
+    next to the file (flname + '.npz', holding the offsets, neighbors
+    and names arrays), which later calls load in one step for as long
+    as the file's size and modification time are unchanged.  The cache
+    is written under a temporary name and then renamed, so processes
+    loading at the same time never see part of one, and a cache that
+    cannot be read or written is ignored.
+
+    Args:
+        flname (str): the edge list
+        cache (bool): whether to read and write the cache
+    Returns:
+        CSRGraph: the graph
+    """
+    cache_path = flname + '.npz'
+    stat = os.stat(flname)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    use_cache = cache and np is not None
+
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                if data['stamp'].tolist() == stamp:
+                    return CSRGraph(data['offsets'], data['neighbors'],
+                                    data['names'].tolist())
+        except (OSError, ValueError, KeyError):
+            # rebuilt from the edge list below
+            pass
+
+    # a missing name is given the next number
+    ids = defaultdict()
+    ids.default_factory = ids.__len__
+    src, dst = array('q'), array('q')
+    for sources, targets in _read_edges(flname):
+        src.extend(map(ids.__getitem__, sources))
+        dst.extend(map(ids.__getitem__, targets))
+
+    names = list(ids)
+    offsets, neighbors = _build_csr(src, dst, len(names))
+
+    if use_cache:
+        _write_cache(cache_path, offsets, neighbors, names, stamp)
+
+    return CSRGraph(offsets, neighbors, names)
+
+
+def _write_cache(cache_path, offsets, neighbors, names, stamp):
+    """
+    Writes the cache used by load_graph, doing nothing if it cannot be
+    written.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or '.',
+                                        suffix='.tmp')
+    except OSError:
+        # the graph is still returned, just not cached
+        return
+
+    try:
+        with os.fdopen(fd, 'wb') as fl:
+            np.savez(fl, offsets=offsets, neighbors=neighbors,
+                     names=np.array(names, dtype=str),
+                     stamp=np.array(stamp, dtype=np.int64))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _read_edges(flname, chunk_size=_CHUNK_SIZE):
+    """
+    Reads the edge list flname chunk_size characters at a time,
+    yielding a pair of lists of the source and target names of the
+    edges on the whole lines of each chunk.
+
+    The first two fields of each line are the edge and any others are
+    ignored.  Blank lines are skipped, and a line with a single field
+    raises ValueError.
+    """
+    with open(flname) as fl:
+        rest = ''
+        line_number = 0
+        while rest is not None:
+            chunk = fl.read(chunk_size)
+            if chunk:
+                # keep a partial last line for the next chunk
+                end = chunk.rfind('\n') + 1
+                if end == 0:
+                    rest += chunk
+                    continue
+                lines = (rest + chunk[:end - 1]).split('\n')
+                rest = chunk[end:]
+            else:
+                lines = rest.split('\n')
+                rest = None
+
+            sources, targets = [], []
+            for cols in map(str.split, lines):
+                line_number += 1
+                if len(cols) >= 2:
+                    sources.append(cols[0])
+                    targets.append(cols[1])
+                elif cols:
+                    raise ValueError(f'{flname}, line {line_number}: '
+                                     'expected two vertices')
+
+            if sources:
+                yield sources, targets
+
+
+def _build_csr(src, dst, n_vertices):
+    """
+    Returns the offsets and neighbors arrays of the graph with
+    n_vertices vertices and an edge from src[k] to dst[k] for every
+    k.  Duplicate edges are dropped.
+    """
+    if np is not None:
+        src = np.frombuffer(src, dtype=np.int64)
+        dst = np.frombuffer(dst, dtype=np.int64)
+        # sorts the edges by source then target, dropping duplicates
+        edges = src * n_vertices + dst
+        edges.sort()
+        if len(edges):
+            edges = edges[np.concatenate(([True], edges[1:] != edges[:-1]))]
+        src, dst = np.divmod(edges, n_vertices)
+
+        offsets = np.zeros(n_vertices + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_vertices), out=offsets[1:])
+        neighbors = dst.astype(_id_typecode(n_vertices))
+        return offsets, neighbors
+
+    rows = [set() for _ in range(n_vertices)]
+    for u, v in zip(src, dst):
+        rows[u].add(v)
+
+    offsets = array('q', [0])
+    neighbors = array(_id_typecode(n_vertices))
+    for row in rows:
+        neighbors.extend(sorted(row))
+        offsets.append(len(neighbors))
+
+    return offsets, neighbors
+
+
+# Layout of the header of a graph file written by save_graph: magic
+# bytes, format version, bytes per neighbor id, number of vertices,
+# number of edges and length of the encoded names
+_GRAPH_MAGIC = b'CSRGRAPH'
+_GRAPH_VERSION = 1
+_GRAPH_HEADER = struct.Struct('=8sIIQQQ')
+_GRAPH_HEADER_SIZE = 64
+
+
+def save_graph(G, flname):
+    """
+    Writes the graph G (a DiGraph or CSRGraph) to a file that
+    open_graph can map into memory.
+
+    The file holds a fixed-size header followed by the offsets array
+    (8-byte ints), the neighbors array (4-byte ints, or 8-byte ones for
+    graphs with 2**31 or more vertices), the offsets of each name in
+    the name table (8-byte ints) and the names themselves as UTF-8,
+    all in native byte order.  Vertex objects are stored by their name
+    and other vertices as str(vertex), so graphs from load_data and
+    load_graph are read back with the names from the edge list.
+
+    The file is written under a temporary name and then renamed, so
+    processes that have the old file open keep a consistent copy.
+    """
+    if isinstance(G, DiGraph):
+        G = G.freeze()
+
+    n_vertices, n_edges = G.count_vertices(), G.count_edges()
+    id_typecode = _id_typecode(n_vertices)
+    id_size = array(id_typecode).itemsize
+
+    encoded = [str(v.name if isinstance(v, Vertex) else v).encode()
+               for v in G.names]
+    name_offsets = array('q', [0])
+    for name in encoded:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    header = _GRAPH_HEADER.pack(_GRAPH_MAGIC, _GRAPH_VERSION, id_size,
+                                n_vertices, n_edges, name_offsets[-1])
+
+    tmp_flname = flname + '.tmp'
+    with open(tmp_flname, 'wb') as fl:
+        fl.write(header.ljust(_GRAPH_HEADER_SIZE, b'\0'))
+        _write_ints(fl, G.offsets, 'q')
+        _write_ints(fl, G.neighbors, id_typecode)
+        # keeps the name offsets 8-byte aligned
+        fl.write(b'\0' * (-n_edges * id_size % 8))
+        fl.write(name_offsets)
+        fl.write(b''.join(encoded))
+    os.replace(tmp_flname, flname)
+
+
+def open_graph(flname):
+    """
+    Opens a graph file written by save_graph as a CSRGraph without
+    reading it.
+
+    The file is mapped into memory read-only and the graph's arrays are
+    views of the mapping, so opening takes the same short time whatever
+    the size of the graph.  Every process that opens the same file
+    shares the operating system's one cached copy of it, and the
+    vertex names are only decoded when they are used.
+
+    Raises ValueError if the file is not a graph file.
+    """
+    with open(flname, 'rb') as fl:
+        buf = memoryview(mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ))
+
+    if len(buf) < _GRAPH_HEADER_SIZE:
+        raise ValueError(f'{flname} is not a graph file')
+    magic, version, id_size, n_vertices, n_edges, names_size = \
+        _GRAPH_HEADER.unpack_from(buf)
+    if magic != _GRAPH_MAGIC or version != _GRAPH_VERSION:
+        raise ValueError(f'{flname} is not a graph file')
+
+    pos = _GRAPH_HEADER_SIZE
+    offsets = buf[pos:pos + 8 * (n_vertices + 1)].cast('q')
+    pos += 8 * (n_vertices + 1)
+    neighbors = buf[pos:pos + id_size * n_edges].cast('i' if id_size == 4 else 'q')
+    pos += id_size * n_edges + (-n_edges * id_size % 8)
+    name_offsets = buf[pos:pos + 8 * (n_vertices + 1)].cast('q')
+    pos += 8 * (n_vertices + 1)
+    names = _NameTable(name_offsets, buf[pos:pos + names_size])
+
+    return CSRGraph(offsets, neighbors, names)
+
+
+def _write_ints(fl, ints, typecode):
+    """
+    Writes the integer array ints to the binary file fl as items of the
+    given typecode, without a copy if they are stored that way already.
+    """
+    view = memoryview(ints)
+    if view.format in 'ilq' and view.itemsize == array(typecode).itemsize:
+        fl.write(view.cast('B'))
+    else:
+        fl.write(array(typecode, ints))
+
+
+class _NameTable:
+    """
+    The vertex names of a graph opened with open_graph, decoded from
+    the file as they are looked up.
+    """
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('vertex number out of range')
+
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
 def precision(recommendations, testing_set):
     """
     Precision measures the fraction of positive predictions
     were found in the test set (were true positives).
 
     A precise algorithm rarely makes false positive predictions.
+
+    If either graph is an undirected Graph, edges are compared as
+    unordered pairs.
     """
-    rec_edges = recommendations.edge_set()
-    test_edges = testing_set.edge_set()
+    rec_edges, test_edges = _comparable_edges(recommendations, testing_set)
     intersection = rec_edges.intersection(test_edges)
     
     if len(rec_edges) == 0:
@@ -156,9 +764,11 @@ def recall(recommendations, testing_set):
     """
     Recall measures the fraction of test set that
     were predicted positively.
+
+    If either graph is an undirected Graph, edges are compared as
+    unordered pairs.
     """
-    rec_edges = recommendations.edge_set()
-    test_edges = testing_set.edge_set()
+    rec_edges, test_edges = _comparable_edges(recommendations, testing_set)
     intersection = rec_edges.intersection(test_edges)
     
     if len(test_edges) == 0:
@@ -167,10 +777,40 @@ def recall(recommendations, testing_set):
     return float(len(intersection)) / len(test_edges)
 
 
+def _comparable_edges(G1, G2):
+    """
+    Returns the edge sets of G1 and G2, as unordered pairs if
+    either graph is undirected.
+    """
+    edges1, edges2 = G1.edge_set(), G2.edge_set()
+    if isinstance(G1, Graph) or isinstance(G2, Graph):
+        edges1 = {frozenset(edge) for edge in edges1}
+        edges2 = {frozenset(edge) for edge in edges2}
+
+    return edges1, edges2
+
+
 def bfs(G, s):
     """
     Performs a breadth-first search of the graph G, starting at vertex s.
+
+    The results are stored on the Vertex objects.
+
+    Raises:
+        TypeError: if G is a Graph or CSRGraph and s is not a Vertex
+            (e.g. a graph from load_graph), as there is nowhere to
+            store the results; use bfs_search instead
     """
+    if isinstance(G, Graph):
+        G = G.freeze()
+    if isinstance(G, CSRGraph):
+        if not isinstance(s, Vertex):
+            raise TypeError('bfs stores its results on Vertex objects; '
+                            'use bfs_search for other vertices')
+        d, pi = _bfs_ids(G, G.vertex_id(s))
+        _store_bfs(G, d, pi, sys.maxsize)
+        return
+
     for u in G._edges:
         u.color = 'WHITE'
         u.d = sys.maxsize
@@ -198,7 +838,19 @@ def recommend_friends_for_user(G, s, max_depth):
     Performs a breadth-first search of the graph G, starting at vertex s.
     Does not traverse vertices with d > max_depth.
     Returns a list of all vertices encountered.
+
+    For a CSRGraph whose vertices are not Vertex objects only the list
+    is returned.
     """
+    if isinstance(G, Graph):
+        G = G.freeze()
+    if isinstance(G, CSRGraph):
+        # vertices one level deeper are discovered, but not traversed
+        d, pi = _bfs_ids(G, G.vertex_id(s), max_depth + 1)
+        if isinstance(s, Vertex):
+            _store_bfs(G, d, pi, max_depth)
+        return [G.names[i] for i, di in d.items() if 0 < di <= max_depth]
+
     for u in G._edges:
         u.color = 'WHITE'
         u.d = sys.maxsize
@@ -227,18 +879,433 @@ def recommend_friends_for_user(G, s, max_depth):
     return visited
 
     
-def recommend_all_friends(G, max_depth):
+def recommend_all_friends(G, max_depth, batch_size=None):
     """
     Generates recommendations for all users by performing
     a depth-limited breadth-first search for each user.
-    
-    The resulting recommendations are stored as a DiGraph.
+
+    If batch_size is given, the searches are run batch_size users
+    at a time with multi_source_bfs, which scans each edge once per
+    batch rather than once per user.  The recommendations are the
+    same either way.
+
+    The resulting recommendations are stored as a Graph, with one
+    undirected edge for each pair of users recommended to each other.
+    For an undirected G each pair is only added from one of its
+    users, since either finds the other.  A DiGraph or CSRGraph, such
+    as the one load_data returns, is searched from both users of each
+    pair; if its edges are symmetric, pass G.to_undirected() to halve
+    the work.
     """
-    H = DiGraph()
+    H = Graph()
+    undirected = isinstance(G, Graph)
+    if batch_size is not None:
+        if not isinstance(G, CSRGraph):
+            G = G.freeze()
+
+        names = G.names
+        for lo in range(0, len(names), batch_size):
+            sources = range(lo, min(lo + batch_size, len(names)))
+            reached = _multi_source_csr(G.offsets, G.neighbors, sources,
+                                        max_depth)
+
+            # regroup the vertices reached by source
+            found = [[] for _ in sources]
+            for j, mask in reached.items():
+                while mask:
+                    low = mask & -mask
+                    found[low.bit_length() - 1].append(j)
+                    mask ^= low
+
+            for i, ids in zip(sources, found):
+                v = names[i]
+                for j in ids:
+                    if j > i or (j < i and not undirected):
+                        H.add_edge(v, names[j])
+
+        return H
+
+    if undirected:
+        G = G.freeze()
+    if isinstance(G, CSRGraph):
+        # the vectorized search only pays off beyond the neighbors
+        vectorized = np is not None and max_depth > 1
+        if vectorized:
+            offsets, neighbors, visited = _numpy_csr(G)
+
+        for i, v in enumerate(G.names):
+            if vectorized:
+                d = _level_bfs(offsets, neighbors, i, max_depth,
+                               visited).tolist()
+            else:
+                d, _ = _bfs_ids(G, i, max_depth)
+            for j in d:
+                if j > i or (j < i and not undirected):
+                    H.add_edge(v, G.names[j])
+
+        return H
+
     for v in G._edges:
-        visited = recommend_friends_for_user(G, v, max_depth)
-        for u in visited:
-            H.add_edge(v, u)
-            H.add_edge(u, v)
+        d, _ = bfs_search(G, v, max_depth)
+        for u in d:
+            if u is not v:
+                H.add_edge(v, u)
+
+    return H
+
+
+def level_bfs(G, s, max_depth=sys.maxsize):
+    """
+    Performs a breadth-first search of the CSRGraph G, starting at
+    vertex s, one level at a time.  Does not traverse vertices with
+    d > max_depth.
+
+    With NumPy, each level is expanded with a few array operations:
+    the neighbors of the whole frontier are gathered from the CSR
+    arrays, deduplicated with np.unique and filtered through a visited
+    mask, so there is no Python code per edge.  Without NumPy the
+    search falls back to bfs_search.
+
+    Returns a list of the vertices found, not including s, level by
+    level.  These are the vertices recommend_friends_for_user returns.
+    """
+    if isinstance(G, Graph):
+        G = G.freeze()
+    if np is None:
+        d, _ = bfs_search(G, s, max_depth)
+        return list(d)[1:]
+
+    offsets, neighbors, visited = _numpy_csr(G)
+    found = _level_bfs(offsets, neighbors, G.vertex_id(s), max_depth,
+                       visited)
+    return [G.names[i] for i in found[1:].tolist()]
+
+
+def _numpy_csr(G):
+    """
+    Returns NumPy views of the offsets and neighbors arrays of the
+    CSRGraph G, and a cleared visited mask for _level_bfs.
+    """
+    return (np.asarray(G.offsets), np.asarray(G.neighbors),
+            np.zeros(G.count_vertices(), dtype=bool))
+
+
+def _level_bfs(offsets, neighbors, s, max_depth, visited):
+    """
+    level_bfs on vertex numbers of the graph with the given NumPy
+    offsets and neighbors arrays.  visited must be all False, and is
+    left that way, so it can be reused by later searches.
+
+    Returns an array of the numbers of the vertices found, starting
+    with s.
+    """
+    visited[s] = True
+    frontier = np.array([s])
+    levels = [frontier]
+    depth = 0
+    while len(frontier) and depth < max_depth:
+        depth += 1
+        starts = offsets[frontier]
+        lengths = offsets[frontier + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            break
+
+        # positions in neighbors of every edge leaving the frontier
+        ends = np.cumsum(lengths)
+        edges = np.repeat(starts - ends + lengths, lengths) + np.arange(total)
+
+        candidates = np.unique(neighbors[edges])
+        frontier = candidates[~visited[candidates]]
+        visited[frontier] = True
+        levels.append(frontier)
+
+    found = np.concatenate(levels)
+    # clear only the entries this search set
+    visited[found] = False
+    return found
+
+
+def multi_source_bfs(G, sources, max_depth=sys.maxsize):
+    """
+    Performs a breadth-first search of the graph G (a DiGraph or
+    CSRGraph) from every vertex in sources at once.  Does not traverse
+    vertices with d > max_depth from a source.
+
+    Each vertex carries a bitmask of the sources that have reached it,
+    bit k standing for sources[k], and a level of the search scans the
+    edges of each frontier vertex once for all the sources that have it
+    on their frontier.  For a batch of 64 sources this scans up to 64
+    times fewer edges than 64 separate searches.
+
+    Returns a dictionary mapping every vertex reached, including the
+    sources, to the bitmask of the sources that reached it.
+    """
+    if isinstance(G, Graph):
+        G = G.freeze()
+    if isinstance(G, CSRGraph):
+        reached = _multi_source_csr(G.offsets, G.neighbors,
+                                    [G.vertex_id(s) for s in sources],
+                                    max_depth)
+        return {G.names[i]: mask for i, mask in reached.items()}
+
+    seen = defaultdict(int)
+    frontier = defaultdict(int)
+    for k, s in enumerate(sources):
+        seen[s] |= 1 << k
+        frontier[s] |= 1 << k
+
+    depth = 0
+    while frontier and depth < max_depth:
+        depth += 1
+        next_frontier = defaultdict(int)
+        for u, mask in frontier.items():
+            for v in G._edges[u]:
+                new = mask & ~seen[v]
+                if new:
+                    seen[v] |= new
+                    next_frontier[v] |= new
+        frontier = next_frontier
+
+    return {v: mask for v, mask in seen.items() if mask}
+
+
+def _multi_source_csr(offsets, neighbors, sources, max_depth):
+    """
+    multi_source_bfs on vertex numbers of the graph with the given
+    offsets and neighbors arrays.
+    """
+    seen = defaultdict(int)
+    frontier = defaultdict(int)
+    for k, s in enumerate(sources):
+        seen[s] |= 1 << k
+        frontier[s] |= 1 << k
+
+    depth = 0
+    while frontier and depth < max_depth:
+        depth += 1
+        next_frontier = defaultdict(int)
+        for u, mask in frontier.items():
+            for v in neighbors[offsets[u]:offsets[u + 1]]:
+                new = mask & ~seen[v]
+                if new:
+                    seen[v] |= new
+                    next_frontier[v] |= new
+        frontier = next_frontier
+
+    return {v: mask for v, mask in seen.items() if mask}
+
+
+# Number of shards of the sources given to each worker, so that
+# workers that get vertices with small neighborhoods are not left idle
+_SHARDS_PER_WORKER = 4
+
+
+def parallel_recommend_all_friends(G, max_depth, workers=None):
+    """
+    Generates the same recommendations as recommend_all_friends,
+    sharing the searches among several processes.
+
+    G is frozen to a CSRGraph if it is a DiGraph or Graph, and as in
+    recommend_all_friends a directed G is searched from both users of
+    each pair.  Its offsets and neighbors arrays are copied once into
+    shared memory, and each ProcessPoolExecutor worker searches from a
+    contiguous range of sources, sending back only the vertex numbers
+    of the pairs it found.  This process then adds them to the result
+    in the same order as the serial version.  A single worker runs
+    recommend_all_friends directly.
+
+    Args:
+        G (DiGraph, Graph or CSRGraph): the friendship graph
+        max_depth (int): largest distance to recommend
+        workers (int): number of processes. Defaults to os.cpu_count()
+    Returns:
+        Graph: the recommendations
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 2:
+        return recommend_all_friends(G, max_depth)
+
+    undirected = isinstance(G, Graph)
+    if not isinstance(G, CSRGraph):
+        G = G.freeze()
+
+    n = G.count_vertices()
+    n_shards = max(1, min(n, workers * _SHARDS_PER_WORKER))
+    bounds = [n * i // n_shards for i in range(n_shards + 1)]
+
+    blocks = []
+    try:
+        for arr in (G.offsets, G.neighbors):
+            data = memoryview(arr).cast('B')
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(1, data.nbytes))
+            blocks.append(shm)
+            shm.buf[:data.nbytes] = data
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = pool.map(_recommend_shard,
+                              [blocks[0].name] * n_shards,
+                              [blocks[1].name] * n_shards,
+                              [memoryview(G.offsets).format] * n_shards,
+                              [memoryview(G.neighbors).format] * n_shards,
+                              [n] * n_shards,
+                              [len(G.neighbors)] * n_shards,
+                              bounds, bounds[1:],
+                              [max_depth] * n_shards,
+                              [undirected] * n_shards)
+
+            H = Graph()
+            names = G.names
+            for pairs in shards:
+                for k in range(0, len(pairs), 2):
+                    H.add_edge(names[pairs[k]], names[pairs[k + 1]])
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return H
+
+
+def _recommend_shard(offsets_name, neighbors_name, offsets_typecode,
+                     neighbors_typecode, n_vertices, n_edges, lo, hi,
+                     max_depth, undirected):
+    """
+    Worker for parallel_recommend_all_friends.  Searches from the
+    sources numbered lo..hi - 1 of the graph in the shared memory
+    blocks with the given names, and returns the pairs found as a flat
+    array of source and vertex numbers.  For an undirected graph only
+    the pairs found from their lower numbered vertex are returned.
+    """
+    offsets_shm = shared_memory.SharedMemory(name=offsets_name)
+    neighbors_shm = shared_memory.SharedMemory(name=neighbors_name)
+    try:
+        offsets = _shared_array(offsets_shm, offsets_typecode, n_vertices + 1)
+        neighbors = _shared_array(neighbors_shm, neighbors_typecode, n_edges)
+
+        pairs = array(neighbors_typecode)
+        for i in range(lo, hi):
+            d, _ = _bfs_csr(offsets, neighbors, i, max_depth)
+            for j in d:
+                if j > i or (j < i and not undirected):
+                    pairs.append(i)
+                    pairs.append(j)
+
+        neighbors.release()
+        offsets.release()
+        return pairs
+    finally:
+        offsets_shm.close()
+        neighbors_shm.close()
+
+
+def _shared_array(shm, typecode, length):
+    """
+    Returns a memoryview of the first length items of the given
+    typecode in the shared memory block shm, which may be larger.
+    """
+    return shm.buf[:length * array(typecode).itemsize].cast(typecode)
+
+
+def bfs_search(G, s, max_depth=sys.maxsize):
+    """
+    Performs a breadth-first search of the graph G (a DiGraph or
+    CSRGraph), starting at vertex s.  Does not traverse vertices
+    with d > max_depth.
+
+    Unlike bfs, the results are returned rather than stored on the
+    vertices, so any kind of vertex can be used and searches of the
+    same graph can run at the same time.  Only the vertices found are
+    touched, so a search costs the size of the neighborhood explored
+    rather than the size of the graph.
+
+    Returns a pair of dictionaries mapping every vertex found, including
+    s, to its distance from s and to its parent (None for s).  Vertices
+    appear in the order they were found.
+    """
+    if isinstance(G, Graph):
+        G = G.freeze()
+    if isinstance(G, CSRGraph):
+        d, pi = _bfs_ids(G, G.vertex_id(s), max_depth)
+        names = G.names
+        return ({names[i]: di for i, di in d.items()},
+                {names[i]: names[p] if p is not None else None
+                 for i, p in pi.items()})
+
+    d = {s: 0}
+    pi = {s: None}
+    q = deque([s])
+    while q:
+        u = q.popleft()
+        du = d[u] + 1
+        # the neighbors of the deepest vertices are too deep
+        if du > max_depth:
+            continue
+        for v in G._edges[u]:
+            if v not in d:
+                d[v] = du
+                pi[v] = u
+                q.append(v)
+
+    return d, pi
+
+
+def _bfs_ids(G, s, max_depth=sys.maxsize):
+    """
+    bfs_search on vertex numbers of the CSRGraph G.
+    """
+    return _bfs_csr(G.offsets, G.neighbors, s, max_depth)
+
+
+def _bfs_csr(offsets, neighbors, s, max_depth):
+    """
+    bfs_search on vertex numbers of the graph with the given
+    offsets and neighbors arrays.
+    """
+    d = {s: 0}
+    pi = {s: None}
+    q = deque([s])
+    while q:
+        u = q.popleft()
+        du = d[u] + 1
+        if du > max_depth:
+            continue
+        for v in neighbors[offsets[u]:offsets[u + 1]]:
+            if v not in d:
+                d[v] = du
+                pi[v] = u
+                q.append(v)
+
+    return d, pi
+
+
+def _store_bfs(G, d, pi, max_depth):
+    """
+    Copies the result of _bfs_ids onto the Vertex objects of the
+    CSRGraph G, as bfs and recommend_friends_for_user do for a DiGraph.
+    Vertices found deeper than max_depth are left GRAY, and vertices
+    that are not Vertex objects are skipped.
+
+    Only the vertices the search reached are written, and only those
+    the previous search of G wrote are reset to WHITE, so the cost is
+    proportional to the vertices reached rather than to all of G.
+    """
+    for u in G._bfs_touched:
+        u.color = 'WHITE'
+        u.d = sys.maxsize
+        u.pi = None
+
+    names = G.names
+    touched = []
+    for i, di in d.items():
+        u = names[i]
+        if not isinstance(u, Vertex):
+            continue
+        u.d = di
+        u.pi = names[pi[i]] if pi.get(i) is not None else None
+        u.color = 'BLACK' if di <= max_depth else 'GRAY'
+        touched.append(u)
 
-    return H
\ No newline at end of file
+    G._bfs_touched = touched
@@ -1,12 +1,31 @@
 import unittest
 
+import os
 import random
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from graphs import bfs
+from graphs import bfs_search
+from graphs import CSRGraph
 from graphs import DiGraph
+from graphs import Graph
+from graphs import level_bfs
+from graphs import load_data
+from graphs import load_graph
+from graphs import multi_source_bfs
+from graphs import open_graph
+from graphs import parallel_recommend_all_friends
+from graphs import precision
+from graphs import recall
 from graphs import recommend_all_friends
 from graphs import recommend_friends_for_user
+from graphs import save_graph
 from graphs import Vertex
+from graphs import np
+from graphs import _read_edges
 
 def extract_bfs_tree(G):
     """
@@ -73,6 +92,93 @@ class TestRecommendationAllFriends(unittest.TestCase):
         
         
     
+class TestLevelBFS(unittest.TestCase):
+    def test_matches_recommend_friends_for_user(self):
+        g, vertices = generate_linear_graph(60, circular=False)
+        for _ in range(20):
+            g.add_edge(random.choice(vertices), random.choice(vertices))
+        g.add_vertex(Vertex(name=60))
+        c = g.freeze()
+
+        for s in random.sample(vertices, 10):
+            for max_depth in [0, 1, 2, 5, sys.maxsize]:
+                expected = recommend_friends_for_user(g, s, max_depth)
+                observed = level_bfs(c, s, max_depth)
+
+                self.assertEqual(len(observed), len(expected))
+                self.assertSetEqual(set(observed), set(expected))
+
+    def test_levels(self):
+        """
+        Vertices are returned level by level.
+        """
+        g, vertices = generate_linear_graph(9, circular=False)
+        c = g.freeze()
+
+        observed = level_bfs(c, vertices[4])
+
+        self.assertListEqual([abs(v.name - 4) for v in observed],
+                             [1, 1, 2, 2, 3, 3, 4, 4])
+
+
+class TestMultiSourceBFS(unittest.TestCase):
+    def test_matches_bfs_search(self):
+        """
+        Every source reaches the same vertices as a search on its own.
+        """
+        g, vertices = generate_linear_graph(100, circular=False)
+        for _ in range(30):
+            g.add_edge(random.choice(vertices), random.choice(vertices))
+        sources = random.sample(vertices, 70)
+
+        for G in [g, g.freeze()]:
+            for max_depth in [0, 1, 4, sys.maxsize]:
+                reached = multi_source_bfs(G, sources, max_depth)
+
+                for k, s in enumerate(sources):
+                    d, _ = bfs_search(G, s, max_depth)
+                    observed = {v for v, mask in reached.items()
+                                if mask >> k & 1}
+                    self.assertSetEqual(observed, set(d))
+
+    def test_recommend_all_friends(self):
+        g, vertices = generate_linear_graph(30, circular=True)
+        for _ in range(30):
+            g.add_edge(random.choice(vertices), random.choice(vertices))
+
+        for max_depth in range(5):
+            expected = recommend_all_friends(g, max_depth)
+            for batch_size in [1, 7, 64]:
+                observed = recommend_all_friends(g, max_depth, batch_size)
+                self.assertSetEqual(observed.edge_set(), expected.edge_set())
+                self.assertEqual(observed.count_vertices(),
+                                 expected.count_vertices())
+
+
+class TestParallelRecommendAllFriends(unittest.TestCase):
+    def test_matches_serial(self):
+        g, vertices = generate_linear_graph(50, circular=True)
+        for _ in range(50):
+            g.add_edge(random.choice(vertices), random.choice(vertices))
+        c = g.freeze()
+
+        for max_depth in [1, 3]:
+            expected = recommend_all_friends(c, max_depth)
+            for G in [g, c]:
+                observed = parallel_recommend_all_friends(G, max_depth,
+                                                          workers=2)
+                self.assertSetEqual(observed.edge_set(), expected.edge_set())
+
+    def test_small_graphs(self):
+        g = DiGraph()
+        self.assertEqual(
+            parallel_recommend_all_friends(g, 2, workers=2).count_edges(), 0)
+
+        g.add_edge("a", "b")
+        observed = parallel_recommend_all_friends(g, 2, workers=3)
+        self.assertSetEqual(observed.edge_set(), {frozenset(("a", "b"))})
+
+    
 class TestRecommendationsForUser(unittest.TestCase):
     def test_complete4_d1(self):
         """
@@ -183,6 +289,440 @@ class TestBFS(unittest.TestCase):
         self.assertEqual(t.count_edges(), g.count_edges() / 2)
         self.assertEqual(t.count_vertices(), g.count_vertices())
 
+class TestBFSSearch(unittest.TestCase):
+    def test_linear5(self):
+        """
+        Distances and parents are returned without changing
+        the vertices.
+        """
+        g, vertices = generate_linear_graph(5, circular=False)
+
+        for G in [g, g.freeze()]:
+            d, pi = bfs_search(G, vertices[0])
+
+            self.assertListEqual(list(d), vertices)
+            self.assertListEqual(list(d.values()), [0, 1, 2, 3, 4])
+            self.assertEqual(pi[vertices[0]], None)
+            for i in range(1, 5):
+                self.assertEqual(pi[vertices[i]], vertices[i-1])
+            for v in vertices:
+                self.assertEqual(v.color, "WHITE")
+                self.assertEqual(v.d, sys.maxsize)
+
+    def test_max_depth(self):
+        g, vertices = generate_linear_graph(10, circular=True)
+
+        for G in [g, g.freeze()]:
+            for max_depth in range(6):
+                d, pi = bfs_search(G, vertices[0], max_depth)
+
+                self.assertEqual(len(d), min(2 * max_depth + 1, 10))
+                self.assertLessEqual(max(d.values()), max_depth)
+                self.assertSetEqual(set(pi), set(d))
+
+    def test_any_vertex(self):
+        g = DiGraph()
+        g.add_edge("a", "b")
+        g.add_edge("b", "c")
+        g.add_vertex("d")
+
+        d, pi = bfs_search(g, "a")
+
+        self.assertDictEqual(d, {"a": 0, "b": 1, "c": 2})
+        self.assertDictEqual(pi, {"a": None, "b": "a", "c": "b"})
+
+    def test_concurrent(self):
+        """
+        Searches from different threads do not interfere.
+        """
+        g, vertices = generate_linear_graph(200, circular=True)
+        c = g.freeze()
+        expected = {v: bfs_search(c, v, 50) for v in vertices}
+
+        with ThreadPoolExecutor(4) as executor:
+            observed = list(executor.map(lambda v: bfs_search(c, v, 50),
+                                         vertices))
+
+        self.assertListEqual(observed, [expected[v] for v in vertices])
+
+class TestCSRGraph(unittest.TestCase):
+    def test_freeze(self):
+        g = DiGraph()
+        g.add_edge("a", "c")
+        g.add_edge("a", "b")
+        g.add_edge("c", "a")
+        g.add_vertex("d")
+
+        c = g.freeze()
+
+        self.assertIsInstance(c, CSRGraph)
+        self.assertEqual(c.count_vertices(), 4)
+        self.assertEqual(c.count_edges(), 3)
+        self.assertSetEqual(c.edge_set(), g.edge_set())
+        self.assertTrue(c.vertex_exists("d"))
+        self.assertFalse(c.vertex_exists("e"))
+        self.assertTrue(c.edge_exists("a", "b"))
+        self.assertTrue(c.edge_exists("c", "a"))
+        self.assertFalse(c.edge_exists("b", "a"))
+        self.assertFalse(c.edge_exists("a", "e"))
+        self.assertListEqual(sorted(c.get_outgoing_edges("a")), ["b", "c"])
+        self.assertListEqual(c.get_outgoing_edges("d"), [])
+
+        # vertex numbers map back to the original vertices
+        for u in ["a", "b", "c", "d"]:
+            self.assertEqual(c.names[c.vertex_id(u)], u)
+
+    def test_bfs_linear5(self):
+        """
+        BFS on a CSRGraph leaves the same results on the vertices
+        as on a DiGraph.
+        """
+        g, vertices = generate_linear_graph(5, circular=False)
+        g.add_vertex(Vertex(name=5))
+        c = g.freeze()
+
+        bfs(c, vertices[2])
+
+        self.assertListEqual([v.d for v in vertices], [2, 1, 0, 1, 2])
+        self.assertEqual(vertices[2].pi, None)
+        self.assertEqual(vertices[0].pi, vertices[1])
+        self.assertEqual(vertices[4].pi, vertices[3])
+        for v in vertices:
+            self.assertEqual(v.color, "BLACK")
+        self.assertEqual(c.names[5].color, "WHITE")
+
+    def test_bfs_resets_previous_search(self):
+        """
+        Vertices reached by the previous search but not the current
+        one are reset.
+        """
+        g, vertices = generate_linear_graph(6, circular=False)
+        c = g.freeze()
+
+        bfs(c, vertices[0])
+        recommend_friends_for_user(c, vertices[5], 1)
+
+        self.assertListEqual([v.d for v in vertices[:3]], [sys.maxsize] * 3)
+        self.assertListEqual([v.color for v in vertices[:3]], ["WHITE"] * 3)
+        self.assertEqual(vertices[1].pi, None)
+        self.assertListEqual([v.d for v in vertices[3:]], [2, 1, 0])
+        self.assertListEqual([v.color for v in vertices[3:]],
+                             ["GRAY", "BLACK", "BLACK"])
+
+    def test_recommend_friends_for_user(self):
+        g, vertices = generate_complete_graph(4)
+        c = g.freeze()
+
+        recommendations = recommend_friends_for_user(c, vertices[0], 0)
+
+        self.assertEqual(len(recommendations), 0)
+        self.assertEqual(vertices[0].color, "BLACK")
+        for v in vertices[1:]:
+            self.assertEqual(v.color, "GRAY")
+            self.assertEqual(v.d, 1)
+
+    def test_string_vertices(self):
+        """
+        The BFS functions work on graphs whose vertices are not
+        Vertex objects, such as those from load_graph.
+        """
+        g = DiGraph()
+        for i in range(5):
+            g.add_edge(str(i), str(i + 1))
+        c = g.freeze()
+
+        self.assertRaises(TypeError, bfs, c, "0")
+        self.assertListEqual(recommend_friends_for_user(c, "0", 2), ["1", "2"])
+        self.assertListEqual(recommend_friends_for_user(c, "5", 2), [])
+
+    def test_recommend_all_friends(self):
+        g, vertices = generate_linear_graph(20, circular=True)
+        for _ in range(20):
+            g.add_edge(random.choice(vertices), random.choice(vertices))
+        c = g.freeze()
+
+        for max_depth in range(4):
+            expected = recommend_all_friends(g, max_depth)
+            observed = recommend_all_friends(c, max_depth)
+            self.assertSetEqual(observed.edge_set(), expected.edge_set())
+
+class TestLoadGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.flname = os.path.join(self.tmpdir, 'testing_set.tsv')
+        shutil.copy(os.path.join(here, 'facebook_data', 'testing_set.tsv'),
+                    self.flname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_load_data(self):
+        g, _ = load_data(self.flname, self.flname)
+        expected = {(u.name, v.name) for u, v in g.edge_set()}
+
+        for cache in [False, True, True]:
+            c = load_graph(self.flname, cache=cache)
+
+            self.assertEqual(c.count_vertices(), g.count_vertices())
+            self.assertEqual(c.count_edges(), g.count_edges())
+            self.assertSetEqual(c.edge_set(), expected)
+
+    def test_cache_invalidated(self):
+        """
+        The cache is rebuilt after the edge list changes.
+        """
+        c = load_graph(self.flname)
+        n_edges = c.count_edges()
+
+        with open(self.flname, 'a') as fl:
+            fl.write('new1\tnew2\n')
+
+        c = load_graph(self.flname)
+        self.assertEqual(c.count_edges(), n_edges + 1)
+        self.assertTrue(c.edge_exists('new1', 'new2'))
+
+    def test_unwritable_cache(self):
+        """
+        The graph is loaded even if the cache cannot be written, and
+        a damaged cache is replaced.
+        """
+        if np is None:
+            self.skipTest('the cache needs NumPy')
+
+        expected = load_graph(self.flname, cache=False).edge_set()
+        os.mkdir(self.flname + '.npz')
+        self.assertSetEqual(load_graph(self.flname).edge_set(), expected)
+        os.rmdir(self.flname + '.npz')
+
+        with open(self.flname + '.npz', 'wb') as fl:
+            fl.write(b'PK not a cache')
+        self.assertSetEqual(load_graph(self.flname).edge_set(), expected)
+        self.assertSetEqual(load_graph(self.flname).edge_set(), expected)
+        self.assertListEqual(sorted(os.listdir(self.tmpdir)),
+                             ['testing_set.tsv', 'testing_set.tsv.npz'])
+
+    def test_read_edges_chunks(self):
+        """
+        Lines split across chunks are put back together.
+        """
+        with open(self.flname) as fl:
+            expected = [tuple(ln.split()) for ln in fl]
+
+        for chunk_size in [1, 7, 1000]:
+            observed = []
+            for sources, targets in _read_edges(self.flname, chunk_size):
+                observed.extend(zip(sources, targets))
+            self.assertListEqual(observed, expected)
+
+    def test_extra_fields(self):
+        """
+        Only the first two fields of a line are the edge.
+        """
+        with open(self.flname, 'w') as fl:
+            fl.write('a b 1\n\nc d 2 x\ne f')
+
+        expected = {('a', 'b'), ('c', 'd'), ('e', 'f')}
+        c = load_graph(self.flname, cache=False)
+        g, _ = load_data(self.flname, self.flname)
+
+        self.assertSetEqual(c.edge_set(), expected)
+        self.assertSetEqual({(u.name, v.name) for u, v in g.edge_set()},
+                            expected)
+
+    def test_bad_line(self):
+        with open(self.flname, 'w') as fl:
+            fl.write('a b\nc\nd e\n')
+
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            load_graph(self.flname, cache=False)
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            load_data(self.flname, self.flname)
+
+    def test_no_trailing_newline_or_duplicates(self):
+        with open(self.flname, 'w') as fl:
+            fl.write('a b\nb c\na b\nc a')
+
+        c = load_graph(self.flname, cache=False)
+
+        self.assertListEqual(c.names, ['a', 'b', 'c'])
+        self.assertSetEqual(c.edge_set(), {('a', 'b'), ('b', 'c'), ('c', 'a')})
+
+class TestGraphFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.flname = os.path.join(self.tmpdir, 'graph.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        g = DiGraph()
+        for _ in range(200):
+            g.add_edge(str(random.randrange(50)), str(random.randrange(50)))
+        g.add_edge("ünïcode", "0")
+        g.add_vertex("alone")
+        c = g.freeze()
+
+        save_graph(g, self.flname)
+        observed = open_graph(self.flname)
+
+        self.assertListEqual(list(observed.names), c.names)
+        self.assertListEqual(list(observed.offsets), list(c.offsets))
+        self.assertListEqual(list(observed.neighbors), list(c.neighbors))
+        self.assertSetEqual(observed.edge_set(), g.edge_set())
+        self.assertTrue(observed.edge_exists("ünïcode", "0"))
+        self.assertListEqual(observed.get_outgoing_edges("alone"), [])
+        self.assertEqual(observed.names[-1], c.names[-1])
+        for max_depth in [1, 3]:
+            self.assertSetEqual(recommend_all_friends(observed, max_depth).edge_set(),
+                                recommend_all_friends(c, max_depth).edge_set())
+
+    def test_round_trip_load_data(self):
+        """
+        Vertex objects are stored by name.
+        """
+        here = os.path.dirname(os.path.abspath(__file__))
+        testing_set = os.path.join(here, 'facebook_data', 'testing_set.tsv')
+        g, _ = load_data(testing_set, testing_set)
+
+        save_graph(g, self.flname)
+        observed = open_graph(self.flname)
+
+        self.assertSetEqual(observed.edge_set(),
+                            {(u.name, v.name) for u, v in g.edge_set()})
+        self.assertSetEqual(observed.edge_set(),
+                            load_graph(testing_set, cache=False).edge_set())
+
+    def test_empty(self):
+        save_graph(DiGraph(), self.flname)
+        observed = open_graph(self.flname)
+
+        self.assertEqual(observed.count_vertices(), 0)
+        self.assertEqual(observed.count_edges(), 0)
+
+    def test_not_a_graph_file(self):
+        with open(self.flname, 'wb') as fl:
+            fl.write(b'a b\n' * 100)
+
+        with self.assertRaises(ValueError):
+            open_graph(self.flname)
+
+class TestUndirectedGraph(unittest.TestCase):
+    def test_add_edge(self):
+        g = Graph()
+
+        g.add_edge("a", "b")
+        g.add_edge("b", "a")
+        g.add_edge("c", "a")
+        g.add_vertex("d")
+
+        self.assertEqual(g.count_vertices(), 4)
+        self.assertEqual(g.count_edges(), 2)
+        self.assertTrue(g.edge_exists("a", "b"))
+        self.assertTrue(g.edge_exists("b", "a"))
+        self.assertTrue(g.edge_exists("a", "c"))
+        self.assertFalse(g.edge_exists("b", "c"))
+        self.assertFalse(g.edge_exists("a", "e"))
+        self.assertSetEqual(g.edge_set(), {frozenset(("a", "b")),
+                                           frozenset(("a", "c"))})
+        self.assertListEqual(sorted(g.get_neighbors("a")), ["b", "c"])
+        self.assertListEqual(g.get_neighbors("c"), ["a"])
+        self.assertListEqual(g.get_neighbors("d"), [])
+
+        # neighbors reflect later changes
+        g.add_edge("d", "c")
+        self.assertListEqual(sorted(g.get_neighbors("c")), ["a", "d"])
+
+    def test_neighbors_after_changes(self):
+        """
+        Neighbor queries interleaved with changes do not rebuild the
+        CSRGraph, and freeze() includes the changes.
+        """
+        g = Graph()
+        g.add_edge("a", "b")
+        self.assertListEqual(g.get_neighbors("a"), ["b"])
+        frozen = g._frozen
+
+        g.add_edge("c", "a")
+        g.add_edge("c", "c")
+        g.add_vertex("d")
+        self.assertListEqual(sorted(g.get_neighbors("a")), ["b", "c"])
+        self.assertListEqual(sorted(g.get_neighbors("c")), ["a", "c"])
+        self.assertListEqual(g.get_neighbors("b"), ["a"])
+        self.assertListEqual(g.get_neighbors("d"), [])
+        self.assertRaises(KeyError, g.get_neighbors, "e")
+        self.assertIs(frozen, g._frozen)
+
+        G = g.freeze()
+        self.assertIsNot(frozen, G)
+        self.assertIs(G, g.freeze())
+        self.assertEqual(G.count_vertices(), 4)
+        self.assertListEqual(sorted(g.get_neighbors("c")), ["a", "c"])
+        self.assertSetEqual(G.edge_set(), {("a", "b"), ("b", "a"),
+                                           ("a", "c"), ("c", "a"),
+                                           ("c", "c")})
+
+    def test_to_undirected(self):
+        g, vertices = generate_linear_graph(6, circular=True)
+        g.add_edge(vertices[0], vertices[3])
+
+        u = g.to_undirected()
+
+        self.assertEqual(u.count_vertices(), 6)
+        self.assertEqual(u.count_edges(), 7)
+        self.assertSetEqual(u.freeze().edge_set(),
+                            g.edge_set() | {(vertices[3], vertices[0])})
+
+    def test_recommend_all_friends(self):
+        """
+        Recommendations for an undirected graph match those for
+        the DiGraph with both directions of each edge.
+        """
+        g, vertices = generate_linear_graph(30, circular=True)
+        for _ in range(20):
+            u, v = random.sample(vertices, 2)
+            g.add_edge(u, v)
+            g.add_edge(v, u)
+        u = g.to_undirected()
+
+        for max_depth in range(4):
+            expected = recommend_all_friends(g, max_depth)
+            for batch_size in [None, 8]:
+                observed = recommend_all_friends(u, max_depth, batch_size)
+                self.assertIsInstance(observed, Graph)
+                self.assertSetEqual(observed.edge_set(), expected.edge_set())
+
+            observed = parallel_recommend_all_friends(u, max_depth, workers=2)
+            self.assertSetEqual(observed.edge_set(), expected.edge_set())
+
+    def test_bfs(self):
+        g, vertices = generate_linear_graph(5, circular=False)
+        u = g.to_undirected()
+
+        bfs(u, vertices[0])
+        self.assertListEqual([v.d for v in vertices], [0, 1, 2, 3, 4])
+
+        recommendations = recommend_friends_for_user(u, vertices[4], 2)
+        self.assertSetEqual(set(recommendations), set(vertices[2:4]))
+
+    def test_precision_recall(self):
+        """
+        Unordered recommendations are scored against a directed
+        test set as pairs.
+        """
+        recommendations = Graph()
+        recommendations.add_edge("a", "b")
+        recommendations.add_edge("a", "c")
+
+        testing_set = DiGraph()
+        testing_set.add_edge("b", "a")
+        testing_set.add_edge("a", "b")
+        testing_set.add_edge("c", "d")
+
+        self.assertEqual(precision(recommendations, testing_set), 0.5)
+        self.assertEqual(recall(recommendations, testing_set), 0.5)
+
 class TestGraph(unittest.TestCase):
     def test_init(self):
         g = DiGraph()